@@ -3,9 +3,6 @@ import pickle
 import glob
 from itertools import chain
 
-from fontTools.ttLib import TTCollection, TTFont
-from fontTools.unicode import Unicode
-
 from .utils import md5, load_chars
 
 
@@ -44,6 +41,8 @@ def load_font(font_path):
     """
     Read ttc, ttf, otf font file, return a TTFont object
     """
+    # fontTools is only needed when supported chars of a font are not cached
+    from fontTools.ttLib import TTCollection, TTFont
 
     # ttc is collection of ttf
     if font_path.endswith('ttc'):
@@ -0,0 +1,146 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+IMG_FORMATS = ['jpg', 'png', 'webp', 'npy']
+
+# Valid range of encode params, opencv clamps or ignores values out of range without warning.
+# webp quality 101 is lossless
+QUALITY_RANGES = {'jpg': (0, 100), 'webp': (1, 101)}
+PNG_COMPRESSION_RANGE = (0, 9)
+
+
+def check_encode_params(img_format, quality=None, png_compression=None):
+    """
+    :param img_format: if None or a format without quality, quality valid for any format is accepted
+    :return: error message, None if params are valid
+    """
+    formats = [img_format] if img_format in QUALITY_RANGES else list(QUALITY_RANGES.keys())
+    if quality is not None and not any([QUALITY_RANGES[f][0] <= quality <= QUALITY_RANGES[f][1] for f in formats]):
+        return "img_quality should in %s" % ', '.join(['[%d, %d] for %s' % (QUALITY_RANGES[f] + (f,)) for f in formats])
+
+    if png_compression is not None and \
+            not PNG_COMPRESSION_RANGE[0] <= png_compression <= PNG_COMPRESSION_RANGE[1]:
+        return "png_compression should in [%d, %d]" % PNG_COMPRESSION_RANGE
+
+    return None
+
+
+class ImageEncoder(object):
+    """
+    Encode rendered images to bytes of one format.
+
+    :param img_format: jpg, png, webp or npy (uncompressed numpy array)
+    :param quality: jpg quality in [0, 100], webp quality in [1, 101], webp is lossless if quality is 101.
+                    If None, use opencv default
+    :param png_compression: png zlib level in [0, 9], larger is smaller and slower. If None, use opencv default
+    """
+
+    def __init__(self, img_format='jpg', quality=None, png_compression=None):
+        if img_format not in IMG_FORMATS:
+            raise ValueError("Image format [%s] not supported" % img_format)
+
+        error = check_encode_params(img_format, quality, png_compression)
+        if error is not None:
+            raise ValueError(error)
+
+        self.ext = '.' + img_format
+        self.params = []
+        if img_format == 'jpg' and quality is not None:
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif img_format == 'webp' and quality is not None:
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        elif img_format == 'png' and png_compression is not None:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+
+    @staticmethod
+    def from_flags(flags):
+        return ImageEncoder(flags.img_format, flags.img_quality, flags.png_compression)
+
+    def encode(self, img):
+        """
+        :param img: float or uint8 image from renderer
+        :return: encoded image bytes
+        """
+        if img.dtype != np.uint8:
+            # Same rounding and saturation as opencv does when encoding a float image
+            img = np.clip(np.around(img), 0, 255).astype(np.uint8)
+
+        if self.ext == '.npy':
+            buf = io.BytesIO()
+            np.save(buf, img)
+            return buf.getvalue()
+
+        ok, buf = cv2.imencode(self.ext, img, self.params)
+        if not ok:
+            raise IOError("Encode image to %s failed" % self.ext)
+        return buf.tobytes()
+
+
+class ImageWriter(object):
+    """
+    Encode images and write them to disk.
+
+    If num_threads > 0, encoding (cv2.imencode releases the GIL) and file writing run in a background
+    thread pool, so rendering never waits on disk. At most max_pending images can be waiting in the pool,
+    write() blocks when the pool is full.
+    """
+
+    def __init__(self, num_threads=0, max_pending=16, encoder=None):
+        self.encoder = encoder or ImageEncoder()
+        self.executor = None
+        self.futures = []
+        self.dirs = set()
+
+        if num_threads > 0:
+            self.executor = ThreadPoolExecutor(max_workers=num_threads)
+            self.slots = threading.BoundedSemaphore(max(max_pending, num_threads))
+
+    def write(self, path, img):
+        """
+        :param path: image path, should have same extension as encoder
+        :param img: numpy image, should not be modified after write() is called
+        """
+        self.make_dir(os.path.dirname(path))
+
+        if self.executor is None:
+            self.encode_and_write(path, img)
+            return
+
+        # backpressure: wait until a pending image is written
+        self.slots.acquire()
+        future = self.executor.submit(self.encode_and_write, path, img)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def make_dir(self, dir_path):
+        # Only check a dir once, instead of one makedirs() syscall per image
+        if dir_path in self.dirs:
+            return
+        os.makedirs(dir_path, exist_ok=True)
+        self.dirs.add(dir_path)
+
+    def flush(self):
+        """
+        Wait until all images are written, errors in background threads are raised here
+        """
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def encode_and_write(self, path, img):
+        buf = self.encoder.encode(img)
+
+        # Use python open() instead of cv2.imwrite() also makes non-ascii path works on Windows
+        with open(path, mode='wb') as f:
+            f.write(buf)
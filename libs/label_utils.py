@@ -0,0 +1,125 @@
+import os
+import glob
+import heapq
+
+SHARD_DIR_NAME = 'label_shards'
+
+# Large sequential reads/writes when merging label runs
+IO_BUFFER_SIZE = 1024 * 1024
+
+
+class LabelShardWriter(object):
+    """
+    Append labels of one worker process to its own shard file, no cross-process communication needed.
+    Each line is "{img_index} {label}", img_index has no fixed width.
+    """
+
+    def __init__(self, shard_dir, name, buffer_size=IO_BUFFER_SIZE):
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir, exist_ok=True)
+
+        self.name = name + '.txt'
+        self.path = os.path.join(shard_dir, self.name)
+        self.f = open(self.path, mode='ab', buffering=buffer_size)
+
+    def write(self, img_index, label):
+        self.f.write('{} {}\n'.format(img_index, label).encode('utf-8'))
+
+    def flush(self):
+        """
+        :return: size of shard file in bytes, all labels written before are included
+        """
+        self.f.flush()
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+def get_shard_paths(shard_dir):
+    return sorted(glob.glob(os.path.join(shard_dir, '*.txt')))
+
+
+def read_label_file(label_fname, start_index=0):
+    """
+    Read labels.txt as a sorted run, line i is the label of image start_index + i
+    :return: generator of (img_index, label)
+    """
+    with open(label_fname, mode='r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+        for img_index, line in enumerate(f, start_index):
+            yield img_index, line.rstrip('\n')
+
+
+def read_label_shard(shard_fname):
+    """
+    Read a shard written by LabelShardWriter. A worker process gets chunks in increasing index order,
+    so lines in one shard are already sorted.
+    :return: generator of (img_index, label)
+    """
+    last_index = -1
+    with open(shard_fname, mode='r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+        for line in f:
+            img_index, label = line.rstrip('\n').split(' ', 1)
+            img_index = int(img_index)
+            if img_index <= last_index:
+                raise ValueError("Label shard %s is not sorted at index %d" % (shard_fname, img_index))
+            last_index = img_index
+            yield img_index, label
+
+
+def merge_label_runs(runs, label_fname, start_index=0):
+    """
+    k-way merge sorted label runs into label_fname with one sequential pass, memory usage is
+    bounded by the number of runs. If an image index appears in more than one run, label from the
+    later run wins.
+    :param runs: list of (img_index, label) iterators, each sorted by img_index
+    :param label_fname: output labels file, line i is the label of image start_index + i
+    :return: number of labels written
+    """
+    tmp_fname = label_fname + '.tmp'
+    count = 0
+    missing = 0
+    pending = None
+    merged = heapq.merge(*runs, key=lambda x: x[0])
+
+    with open(tmp_fname, mode='w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+        for item in merged:
+            if pending is not None and item[0] != pending[0]:
+                missing += pending[0] - (start_index + count)
+                f.write(pending[1] + '\n')
+                count += 1
+            pending = item
+
+        if pending is not None:
+            missing += pending[0] - (start_index + count)
+            f.write(pending[1] + '\n')
+            count += 1
+
+    os.replace(tmp_fname, label_fname)
+
+    if missing != 0:
+        print("Warning: %d image indexes have no label, lines in %s are not aligned with image index" % (
+            missing, label_fname))
+    return count
+
+
+def finalize_labels(shard_dir, label_fname, start_index=0):
+    """
+    Merge worker shards into existing labels file and remove merged shards, shard_dir is removed if it is empty
+    """
+    shard_paths = get_shard_paths(shard_dir)
+
+    runs = []
+    if os.path.exists(label_fname):
+        runs.append(read_label_file(label_fname, start_index))
+    runs.extend([read_label_shard(p) for p in shard_paths])
+
+    count = merge_label_runs(runs, label_fname, start_index)
+
+    for p in shard_paths:
+        os.remove(p)
+
+    # Recreated by LabelShardWriter when more images are appended
+    if os.path.isdir(shard_dir) and not os.listdir(shard_dir):
+        os.rmdir(shard_dir)
+    return count
@@ -0,0 +1,116 @@
+import os
+import json
+from itertools import chain
+
+MANIFEST_NAME = 'progress.json'
+
+
+def split_chunks(start, end, chunk_size):
+    for chunk_start in range(start, end, chunk_size):
+        yield chunk_start, min(chunk_start + chunk_size, end)
+
+
+def count_lines(filepath, block_size=1024 * 1024):
+    count = 0
+    with open(filepath, mode='rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            count += block.count(b'\n')
+    return count
+
+
+class Manifest(object):
+    """
+    Small sidecar file in save_dir recording the progress of a generation job. It is rewritten atomically
+    after every finished chunk, so a killed job can restart at the exact next index.
+
+    start_index: image index of the first line in labels.txt
+    end_index: images in [start_index, end_index) should exist when current job finished
+    next_index: all images before next_index are finished
+    done_chunks: finished chunks after next_index, chunks finish out of order
+    run: increased by one every time main.py starts, label shards of each run have different names
+    seed: random seed of images in this dir
+    files_per_dir: image dir layout, see libs.utils.get_img_rel_path()
+    output_mode: sink type of images in this dir, see libs.sink.sink_utils
+    img_format: encoding of images, see libs.image_writer.ImageEncoder
+    shards: shard path relative to save_dir -> committed size in bytes.
+            Bytes after committed size belong to unfinished chunks
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start_index = 0
+        self.end_index = 0
+        self.next_index = 0
+        self.done_chunks = []
+        self.run = 0
+        self.seed = None
+        self.files_per_dir = 0
+        self.output_mode = 'files'
+        self.img_format = 'jpg'
+        self.shards = {}
+
+    @staticmethod
+    def load(save_dir):
+        manifest = Manifest(os.path.join(save_dir, MANIFEST_NAME))
+        if os.path.exists(manifest.path):
+            with open(manifest.path, mode='r', encoding='utf-8') as f:
+                manifest.__dict__.update(json.load(f))
+        return manifest
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self):
+        data = {k: v for k, v in self.__dict__.items() if k != 'path'}
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def is_finished(self):
+        return self.next_index >= self.end_index
+
+    def num_pending(self):
+        return self.end_index - self.next_index - sum([end - start for start, end in self.done_chunks])
+
+    def pending_chunks(self, chunk_size):
+        """
+        Split unfinished image indexes in [next_index, end_index) into chunks.
+        Unfinished ranges are collected eagerly, so mark_done() can be called while iterating.
+        """
+        ranges = []
+        cursor = self.next_index
+        for start, end in self.done_chunks:
+            ranges.append((cursor, start))
+            cursor = end
+        ranges.append((cursor, self.end_index))
+
+        return chain.from_iterable([split_chunks(start, end, chunk_size) for start, end in ranges])
+
+    def mark_done(self, start, end, shards=None):
+        self.done_chunks.append([start, end])
+        self.done_chunks.sort()
+        while self.done_chunks and self.done_chunks[0][0] == self.next_index:
+            self.next_index = self.done_chunks.pop(0)[1]
+
+        if shards is not None:
+            self.shards.update(shards)
+
+    def rollback_shards(self, save_dir, shard_paths):
+        """
+        Truncate shards to their committed size, remove shards that have no finished chunk.
+        After this, shards only contain data of finished chunks.
+        :param shard_paths: all shard paths relative to save_dir, committed or not
+        """
+        for rel_path in shard_paths:
+            shard_path = os.path.join(save_dir, rel_path)
+            if rel_path not in self.shards:
+                os.remove(shard_path)
+            elif os.path.getsize(shard_path) > self.shards[rel_path]:
+                os.truncate(shard_path, self.shards[rel_path])
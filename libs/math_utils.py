@@ -3,7 +3,6 @@ from functools import reduce
 import numpy as np
 import cv2
 import math
-import random
 
 
 # http://planning.cs.uiuc.edu/node102.html
@@ -40,25 +39,31 @@ def get_rotate_matrix(x, y, z):
     return M_x * M_y * M_z
 
 
-def cliped_rand_norm(mu=0, sigma3=1):
+def cliped_rand_norm(rng, mu=0, sigma3=1):
     """
+    :param rng: numpy random Generator
     :param mu: 均值
     :param sigma3: 3 倍标准差， 99% 的数据落在 (mu-3*sigma, mu+3*sigma)
     :return:
     """
     # 标准差
     sigma = sigma3 / 3
-    dst = sigma * np.random.randn() + mu
+    dst = sigma * rng.standard_normal() + mu
     dst = np.clip(dst, 0 - sigma3, sigma3)
     return dst
 
 
-def warpPerspective(src, M33, sl, gpu):
+def warpPerspective(src, M33, size, gpu):
+    """
+    :param size: (width, height) of dst
+    """
     if gpu:
         from libs.gpu.GpuWrapper import cudaWarpPerspectiveWrapper
-        dst = cudaWarpPerspectiveWrapper(src.astype(np.uint8), M33, (sl, sl), cv2.INTER_CUBIC)
+        # GpuWrapper takes size in (height, width) order
+        dst = cudaWarpPerspectiveWrapper(src.astype(np.uint8), M33.astype(np.float32), (size[1], size[0]),
+                                         cv2.INTER_CUBIC)
     else:
-        dst = cv2.warpPerspective(src, M33, (sl, sl), flags=cv2.INTER_CUBIC)
+        dst = cv2.warpPerspective(src, M33, size, flags=cv2.INTER_CUBIC)
     return dst
 
 
@@ -74,18 +79,22 @@ class PerspectiveTransform(object):
         self.fovy = fovy
 
     def transform_image(self, src, gpu=False):
-        if len(src.shape) > 2:
-            H, W, C = src.shape
-        else:
-            H, W = src.shape
+        M33, sl, ptsOut = self.get_image_warp_matrix(src)
 
-        M33, sl, _, ptsOut = self.get_warp_matrix(W, H, self.x, self.y, self.z, self.scale, self.fovy)
-        sl = int(sl)
-
-        dst = warpPerspective(src, M33, sl, gpu)
+        dst = warpPerspective(src, M33, (sl, sl), gpu)
 
         return dst, M33, ptsOut
 
+    def get_image_warp_matrix(self, src):
+        """
+        Get warp matrix of transform_image() without warping src
+        :return: M33, side length of square dst image, corner pnts of src in dst image
+        """
+        H, W = src.shape[:2]
+
+        M33, sl, _, ptsOut = self.get_warp_matrix(W, H, self.x, self.y, self.z, self.scale, self.fovy)
+        return M33, int(sl), ptsOut
+
     def transform_pnts(self, pnts, M33):
         """
         :param pnts: 2D pnts, left-top, right-top, right-bottom, left-bottom
@@ -0,0 +1,79 @@
+import time
+from collections import Counter
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class ProgressReporter(object):
+    """
+    Aggregate finished chunks reported by worker processes in main process. Workers only count images
+    of their own chunk, so there is no shared counter or lock on the per-image path.
+
+    Progress line is printed at most once every interval seconds, with overall images/sec,
+    min/max rate of workers and ETA. Rate of every worker, failed render attempts by cause and
+    background cache hit rate are printed when job is finished.
+    """
+
+    def __init__(self, total, interval=1.0):
+        self.total = total
+        self.interval = interval
+        self.finished = 0
+        self.start_time = time.time()
+        self.last_report_time = 0
+        # pid -> [images, seconds spent on chunks]
+        self.workers = {}
+        # failure cause -> failed render attempts
+        self.failures = Counter()
+        # background cache hits and misses
+        self.bg_cache = Counter()
+
+    def update(self, chunk_result):
+        count = chunk_result['end'] - chunk_result['start']
+        self.finished += count
+
+        worker = self.workers.setdefault(chunk_result['pid'], [0, 0.])
+        worker[0] += count
+        worker[1] += chunk_result['seconds']
+        self.failures.update(chunk_result['failures'])
+        self.bg_cache.update(chunk_result['bg_cache'])
+
+        now = time.time()
+        if now - self.last_report_time >= self.interval or self.finished >= self.total:
+            self.last_report_time = now
+            self.report(now)
+
+    def worker_rates(self):
+        return {pid: count / max(seconds, 1e-6) for pid, (count, seconds) in self.workers.items()}
+
+    def report(self, now):
+        elapsed = max(now - self.start_time, 1e-6)
+        rate = self.finished / elapsed
+        eta = (self.total - self.finished) / max(rate, 1e-6)
+        worker_rates = self.worker_rates().values()
+
+        print_end = '\n' if self.finished >= self.total else '\r'
+        print("{}/{} {:2d}% {:.1f} img/s, {} workers {:.1f}-{:.1f} img/s, elapsed {}, ETA {}".format(
+            self.finished,
+            self.total,
+            int(self.finished / max(self.total, 1) * 100),
+            rate,
+            len(worker_rates),
+            min(worker_rates),
+            max(worker_rates),
+            format_seconds(elapsed),
+            format_seconds(eta)), end=print_end)
+
+    def summary(self):
+        for pid, rate in sorted(self.worker_rates().items()):
+            print("Worker %d: %d images, %.1f img/s" % (pid, self.workers[pid][0], rate))
+
+        if self.failures:
+            print("Failed render attempts (retried): %s" % ', '.join(
+                ['%s %d' % (cause, count) for cause, count in self.failures.most_common()]))
+
+        lookups = self.bg_cache['hits'] + self.bg_cache['misses']
+        if lookups:
+            print("Background cache: %d lookups, hit rate %.1f%%" % (lookups, self.bg_cache['hits'] / lookups * 100))
@@ -0,0 +1,47 @@
+import os
+
+from libs.image_writer import ImageWriter, ImageEncoder
+from libs.label_utils import LabelShardWriter, finalize_labels, get_shard_paths, SHARD_DIR_NAME
+from libs.sink.sink import Sink
+from libs.utils import get_img_rel_path
+
+LABEL_NAME = 'labels.txt'
+
+
+class FileSink(Sink):
+    """
+    One image file per image and a labels.txt, labels of each worker go to a label shard
+    and are merged into labels.txt when job is finished
+    """
+
+    def __init__(self, save_dir, name, flags):
+        super().__init__(save_dir, name, flags)
+        self.encoder = ImageEncoder.from_flags(flags)
+        self.image_writer = ImageWriter(flags.write_threads, flags.write_queue_size, self.encoder)
+        self.label_writer = LabelShardWriter(os.path.join(save_dir, SHARD_DIR_NAME), name)
+        self.label_rel_path = os.path.join(SHARD_DIR_NAME, self.label_writer.name)
+
+    def write(self, img_index, img, label):
+        rel_path = get_img_rel_path(img_index, self.flags.files_per_dir, self.encoder.ext)
+        fname = os.path.join(self.save_dir, rel_path)
+        self.image_writer.write(fname, img)
+        self.label_writer.write(img_index, label)
+
+    def flush(self):
+        # Labels are committed only when all images before them are on disk
+        self.image_writer.flush()
+        return {self.label_rel_path: self.label_writer.flush()}
+
+    def close(self):
+        self.image_writer.close()
+        self.label_writer.close()
+
+    @classmethod
+    def list_shards(cls, save_dir):
+        shard_dir = os.path.join(save_dir, SHARD_DIR_NAME)
+        return [os.path.relpath(p, save_dir) for p in get_shard_paths(shard_dir)]
+
+    @classmethod
+    def finalize(cls, save_dir, manifest):
+        finalize_labels(os.path.join(save_dir, SHARD_DIR_NAME), os.path.join(save_dir, LABEL_NAME),
+                        manifest.start_index)
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+
+from libs.config import load_config
+from libs.label_utils import LabelShardWriter, read_label_file, SHARD_DIR_NAME
+from libs.manifest import Manifest
+from libs.sink.file_sink import FileSink, LABEL_NAME
+from libs.sink.sink import Sink
+from libs.utils import to_uint8
+from textrenderer.renderer import is_bgr_cfg
+
+IMAGES_NAME = 'images.npy'
+LABELS_NAME = 'labels.npy'
+
+# Rows copied at once when images.npy grows
+COPY_BLOCK_SIZE = 4096
+
+
+def get_images_shape(flags, num_img):
+    cfg = load_config(flags.config_file)
+    if is_bgr_cfg(cfg):
+        return num_img, flags.img_height, flags.img_width, 3
+    return num_img, flags.img_height, flags.img_width
+
+
+def create_images(images_path, shape):
+    """
+    Create images.npy with shape, images in exist images.npy are copied to the new one
+    """
+    old_images = None
+    if os.path.exists(images_path):
+        old_images = np.load(images_path, mmap_mode='r')
+        if old_images.shape[1:] != shape[1:]:
+            print('Image shape %s is different from exist images %s in %s' % (
+                shape[1:], old_images.shape[1:], images_path))
+            exit(-1)
+        if old_images.shape[0] >= shape[0]:
+            return
+
+    tmp_path = images_path + '.tmp'
+    images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape)
+    if old_images is not None:
+        print('Grow %s from %d to %d images' % (images_path, old_images.shape[0], shape[0]))
+        for start in range(0, old_images.shape[0], COPY_BLOCK_SIZE):
+            end = min(start + COPY_BLOCK_SIZE, old_images.shape[0])
+            images[start:end] = old_images[start:end]
+    images.flush()
+    del images, old_images
+    os.replace(tmp_path, images_path)
+
+
+class MemmapSink(Sink):
+    """
+    All images in one preallocated uint8 array images.npy, image i is at row i - start_index.
+    Every worker writes rows of its own images in place through a memory map.
+    Labels are collected like FileSink, labels.txt and labels.npy (unicode array) are created when job is finished.
+
+    Load dataset without decoding or copying:
+        images = np.load('images.npy', mmap_mode='r')
+        labels = np.load('labels.npy', mmap_mode='r')
+    """
+
+    def __init__(self, save_dir, name, flags):
+        super().__init__(save_dir, name, flags)
+        self.label_writer = LabelShardWriter(os.path.join(save_dir, SHARD_DIR_NAME), name)
+        self.label_rel_path = os.path.join(SHARD_DIR_NAME, self.label_writer.name)
+
+        self.start_index = Manifest.load(save_dir).start_index
+        self.images = np.load(os.path.join(save_dir, IMAGES_NAME), mmap_mode='r+')
+
+    def write(self, img_index, img, label):
+        if img.shape != self.images.shape[1:]:
+            raise ValueError("Image %d has shape %s, memmap output needs %s" % (
+                img_index, img.shape, self.images.shape[1:]))
+        self.images[img_index - self.start_index] = to_uint8(img)
+        self.label_writer.write(img_index, label)
+
+    def flush(self):
+        self.images.flush()
+        return {self.label_rel_path: self.label_writer.flush()}
+
+    def close(self):
+        self.flush()
+        self.label_writer.close()
+
+    @classmethod
+    def prepare(cls, save_dir, manifest, flags):
+        if flags.img_width <= 0 or flags.debug:
+            print('memmap output mode needs fixed image size, img_width should > 0 and debug is not supported')
+            exit(-1)
+
+        shape = get_images_shape(flags, manifest.end_index - manifest.start_index)
+        create_images(os.path.join(save_dir, IMAGES_NAME), shape)
+
+    @classmethod
+    def list_shards(cls, save_dir):
+        return FileSink.list_shards(save_dir)
+
+    @classmethod
+    def finalize(cls, save_dir, manifest):
+        FileSink.finalize(save_dir, manifest)
+
+        labels = [label for _, label in read_label_file(os.path.join(save_dir, LABEL_NAME), manifest.start_index)]
+        tmp_path = os.path.join(save_dir, LABELS_NAME + '.tmp')
+        with open(tmp_path, mode='wb') as f:
+            np.save(f, np.array(labels, dtype=np.str_))
+        os.replace(tmp_path, os.path.join(save_dir, LABELS_NAME))
@@ -0,0 +1,111 @@
+import os
+import glob
+from collections import deque
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.label_utils import IO_BUFFER_SIZE
+from libs.sink.sink import Sink
+
+PART_EXT = '.part'
+
+
+class ShardSink(Sink):
+    """
+    Append encoded images to big shard files with sequential writes. A worker starts a new shard
+    when current shard reaches flags.shard_size_mb.
+
+    Shards are named {name}_{seq:05d}{ext}.part while job is running, and are sealed and renamed to
+    {name}_{seq:05d}{ext} when job is finished.
+    """
+    ext = None
+
+    def __init__(self, save_dir, name, flags):
+        super().__init__(save_dir, name, flags)
+        self.max_shard_size = flags.shard_size_mb * 1024 * 1024
+
+        self.seq = 0
+        self.f = None
+        self.rel_path = None
+        # shard path -> size, shards written since last flush()
+        self.touched = {}
+
+        self.executor = None
+        self.pending = deque()
+        if flags.write_threads > 0:
+            # Images are encoded in background threads, but appended to shard in index order
+            self.executor = ThreadPoolExecutor(max_workers=flags.write_threads)
+            self.max_pending = max(flags.write_queue_size, flags.write_threads)
+
+    @abstractmethod
+    def encode(self, img_index, img, label):
+        """
+        Called in background threads if flags.write_threads > 0
+        :return: bytes of one image appended to shard
+        """
+        pass
+
+    def open_shard(self):
+        if self.f is not None:
+            self.f.close()
+        self.rel_path = '%s_%05d%s%s' % (self.name, self.seq, self.ext, PART_EXT)
+        self.seq += 1
+        self.f = open(os.path.join(self.save_dir, self.rel_path), mode='wb', buffering=IO_BUFFER_SIZE)
+        self.touched[self.rel_path] = 0
+
+    def write(self, img_index, img, label):
+        if self.executor is None:
+            self.append(self.encode(img_index, img, label))
+            return
+
+        # backpressure: append oldest image to shard when there are too many pending images
+        if len(self.pending) >= self.max_pending:
+            self.append(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(self.encode, img_index, img, label))
+
+    def append(self, data):
+        # Shard is created on first image, so a worker that gets no chunk leaves no file
+        if self.f is None:
+            self.open_shard()
+        elif self.f.tell() >= self.max_shard_size:
+            self.touched[self.rel_path] = self.f.tell()
+            self.open_shard()
+
+        self.f.write(data)
+
+    def flush(self):
+        while self.pending:
+            self.append(self.pending.popleft().result())
+
+        if self.f is not None:
+            self.f.flush()
+            self.touched[self.rel_path] = self.f.tell()
+        touched = self.touched
+        self.touched = {}
+        return touched
+
+    def close(self):
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    @classmethod
+    def seal(cls, part_path, size):
+        """
+        Drop bytes after committed size, subclass may append a footer
+        """
+        os.truncate(part_path, size)
+
+    @classmethod
+    def list_shards(cls, save_dir):
+        return [os.path.basename(p) for p in glob.glob(os.path.join(save_dir, '*' + cls.ext + PART_EXT))]
+
+    @classmethod
+    def finalize(cls, save_dir, manifest):
+        for rel_path, size in sorted(manifest.shards.items()):
+            part_path = os.path.join(save_dir, rel_path)
+            if os.path.exists(part_path):
+                cls.seal(part_path, size)
+                os.replace(part_path, part_path[:-len(PART_EXT)])
@@ -0,0 +1,69 @@
+from abc import abstractmethod
+
+
+class Sink(object):
+    """
+    Output of one worker process. Every worker creates its own sink, so workers never share a file.
+
+    A sink writes shard files under save_dir. After each chunk, flush() reports the size of shard files,
+    which is committed in the progress manifest. When a job is restarted, bytes after committed size are
+    dropped by rollback(), when a job is finished, finalize() turns committed shards into final output.
+    """
+
+    def __init__(self, save_dir, name, flags):
+        """
+        :param save_dir: output dir
+        :param name: unique name of this worker in current run, used as shard file name prefix
+        :param flags: parsed command line arguments
+        """
+        self.save_dir = save_dir
+        self.name = name
+        self.flags = flags
+
+    @abstractmethod
+    def write(self, img_index, img, label):
+        """
+        :param img: numpy image, should not be modified after write() is called
+        :param label: text on the image
+        """
+        pass
+
+    @abstractmethod
+    def flush(self):
+        """
+        Make sure all images written before are in shard files
+        :return: dict, shard path relative to save_dir -> shard size in bytes
+        """
+        pass
+
+    def close(self):
+        pass
+
+    @classmethod
+    def prepare(cls, save_dir, manifest, flags):
+        """
+        Called in main process before worker processes start
+        """
+        pass
+
+    @classmethod
+    def list_shards(cls, save_dir):
+        """
+        :return: relative path of all unfinalized shard files of this sink type in save_dir
+        """
+        return []
+
+    @classmethod
+    def rollback(cls, save_dir, manifest):
+        """
+        Truncate shards to their committed size, remove shards that have no finished chunk.
+        After this, shards only contain images of finished chunks.
+        """
+        manifest.rollback_shards(save_dir, cls.list_shards(save_dir))
+
+    @classmethod
+    def finalize(cls, save_dir, manifest):
+        """
+        Called in main process when all images of a job are finished
+        """
+        pass
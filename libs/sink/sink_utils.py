@@ -0,0 +1,23 @@
+import importlib
+
+# output mode -> (module, class name). Modules are imported when the output mode is used,
+# so a job doesn't pay import time (e.g. CRC tables of tfrecord) of other sinks.
+sink_classes = {
+    "files": ("libs.sink.file_sink", "FileSink"),
+    "tar": ("libs.sink.tar_sink", "TarSink"),
+    "tfrecord": ("libs.sink.tfrecord_sink", "TFRecordSink"),
+    "memmap": ("libs.sink.memmap_sink", "MemmapSink")
+}
+
+
+def get_sink_class(output_mode: str):
+    if output_mode not in sink_classes.keys():
+        print("Output mode [%s] not implemented yet" % output_mode)
+        exit(-1)
+
+    module_name, class_name = sink_classes[output_mode]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def sink_factory(output_mode: str, save_dir: str, name: str, flags):
+    return get_sink_class(output_mode)(save_dir, name, flags)
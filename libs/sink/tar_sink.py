@@ -0,0 +1,54 @@
+import time
+import tarfile
+
+from libs.image_writer import ImageEncoder
+from libs.sink.shard_sink import ShardSink
+
+# Two zero blocks mark the end of a tar archive
+END_OF_ARCHIVE = tarfile.NUL * tarfile.BLOCKSIZE * 2
+
+
+def tar_member(name, data, mtime):
+    """
+    :return: tar header + data + padding of one regular file
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    header = info.tobuf(format=tarfile.USTAR_FORMAT)
+
+    remainder = len(data) % tarfile.BLOCKSIZE
+    padding = tarfile.NUL * (tarfile.BLOCKSIZE - remainder) if remainder else b''
+    return header + data + padding
+
+
+class TarSink(ShardSink):
+    """
+    WebDataset style tar shards: {img_index:08d}.jpg (or other --img_format) and {img_index:08d}.txt (utf-8 label)
+    pairs
+    """
+    ext = '.tar'
+
+    def __init__(self, save_dir, name, flags):
+        super().__init__(save_dir, name, flags)
+        self.mtime = int(time.time())
+        self.encoder = ImageEncoder.from_flags(flags)
+
+    def encode(self, img_index, img, label):
+        key = '{:08d}'.format(img_index)
+        return tar_member(key + self.encoder.ext, self.encoder.encode(img), self.mtime) + \
+               tar_member(key + '.txt', label.encode('utf-8'), self.mtime)
+
+    @classmethod
+    def seal(cls, part_path, size):
+        """
+        Append end of archive blocks after committed size
+        """
+        with open(part_path, mode='r+b') as f:
+            f.truncate(size)
+            f.seek(size)
+            f.write(END_OF_ARCHIVE)
+            remainder = (size + len(END_OF_ARCHIVE)) % tarfile.RECORDSIZE
+            if remainder:
+                f.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
@@ -0,0 +1,150 @@
+import struct
+
+import cv2
+import numpy as np
+
+from libs.image_writer import ImageEncoder
+from libs.sink.shard_sink import ShardSink
+from libs.utils import to_uint8
+
+CRC32C_POLY = 0x82f63b78
+CRC_MASK_DELTA = 0xa282ead8
+
+
+# Data longer than this is split into CRC_BLOCK_SIZE lanes and computed with numpy
+CRC_BLOCK_SIZE = 64
+CRC_NUMPY_MIN_SIZE = 2048
+
+
+def make_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ CRC32C_POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+def crc32c_update(crc, data):
+    """
+    Table driven CRC-32C register update without initial value and final xor
+    """
+    table = CRC32C_TABLE
+    for b in data:
+        crc = table[(crc ^ b) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+def make_shift_tables(num_bytes):
+    """
+    crc32c_update(crc, zeros) is linear in crc, so it can be looked up by the 4 bytes of crc
+    """
+    zeros = bytes(num_bytes)
+    return [[crc32c_update(v << (8 * k), zeros) for v in range(256)] for k in range(4)]
+
+
+CRC32C_TABLE = make_crc32c_table()
+CRC32C_TABLE_NP = np.array(CRC32C_TABLE, dtype=np.int64)
+CRC_SHIFT_TABLES = make_shift_tables(CRC_BLOCK_SIZE)
+
+
+def crc32c(data):
+    """
+    CRC-32C (Castagnoli) used by TFRecord.
+    Long data is split into blocks, CRC of all blocks are updated together byte by byte with numpy,
+    then combined with crc(a + b) = shift(crc(a), len(b)) ^ crc(b)
+    """
+    crc = 0xffffffff
+    num_blocks = len(data) // CRC_BLOCK_SIZE if len(data) >= CRC_NUMPY_MIN_SIZE else 0
+
+    if num_blocks > 0:
+        blocks = np.frombuffer(data, np.uint8, num_blocks * CRC_BLOCK_SIZE).reshape(num_blocks, CRC_BLOCK_SIZE)
+        lanes = np.zeros(num_blocks, np.int64)
+        for column in blocks.T.astype(np.int64):
+            lanes = CRC32C_TABLE_NP.take((lanes ^ column) & 0xff) ^ (lanes >> 8)
+
+        t0, t1, t2, t3 = CRC_SHIFT_TABLES
+        for lane in lanes.tolist():
+            crc = t0[crc & 0xff] ^ t1[(crc >> 8) & 0xff] ^ t2[(crc >> 16) & 0xff] ^ t3[crc >> 24] ^ lane
+
+    crc = crc32c_update(crc, memoryview(data)[num_blocks * CRC_BLOCK_SIZE:])
+    return crc ^ 0xffffffff
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + CRC_MASK_DELTA) & 0xffffffff
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_bytes_field(field_number, data):
+    """
+    Protobuf length-delimited field (wire type 2)
+    """
+    return encode_varint(field_number << 3 | 2) + encode_varint(len(data)) + data
+
+
+def encode_example(features):
+    """
+    Serialize a tf.train.Example which only has bytes_list features, same as Example.SerializeToString():
+
+    Example { Features features = 1; }
+    Features { map<string, Feature> feature = 1; }
+    Feature { BytesList bytes_list = 1; }
+    BytesList { repeated bytes value = 1; }
+
+    :param features: dict, feature name -> bytes
+    """
+    entries = []
+    for name, value in sorted(features.items()):
+        feature = encode_bytes_field(1, encode_bytes_field(1, value))
+        entries.append(encode_bytes_field(1, encode_bytes_field(1, name.encode('utf-8')) +
+                                          encode_bytes_field(2, feature)))
+    return encode_bytes_field(1, b''.join(entries))
+
+
+def encode_record(data):
+    """
+    TFRecord framing: uint64 length, uint32 masked crc of length, data, uint32 masked crc of data
+    """
+    length = struct.pack('<Q', len(data))
+    return length + struct.pack('<I', masked_crc32c(length)) + data + struct.pack('<I', masked_crc32c(data))
+
+
+class TFRecordSink(ShardSink):
+    """
+    TFRecord shards with same features as tools/make_tfrecord.py: image, label, file_name.
+    image is float32 gray pixels (make_tfrecord.py default), or encoded image bytes if flags.tfrecord_raw
+    (make_tfrecord.py --raw). TensorFlow is not needed.
+    """
+    ext = '.tfrecords'
+
+    def __init__(self, save_dir, name, flags):
+        super().__init__(save_dir, name, flags)
+        self.encoder = ImageEncoder.from_flags(flags)
+
+    def encode(self, img_index, img, label):
+        file_name = '{:08d}{}'.format(img_index, self.encoder.ext)
+        if self.flags.tfrecord_raw:
+            img_bytes = self.encoder.encode(img)
+        else:
+            # Same pixels as reading saved jpg with cv2.imread(path, 0), without jpg compression loss
+            img = to_uint8(img)
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            img_bytes = img.astype(np.float32).tobytes()
+
+        # tools/make_tfrecord.py strips labels read from labels.txt
+        example = encode_example({'image': img_bytes,
+                                  'label': label.strip().encode('utf-8'),
+                                  'file_name': file_name.encode('utf-8')})
+        return encode_record(example)
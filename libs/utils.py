@@ -4,7 +4,6 @@ import os
 import random
 
 import cv2
-import matplotlib.pyplot as plt
 
 import numpy as np
 import hashlib
@@ -15,6 +14,9 @@ def viz_img(text_im, fignum=1):
     """
     text_im : image containing text
     """
+    # matplotlib takes more time to import than everything else, only --viz needs it
+    import matplotlib.pyplot as plt
+
     text_im = text_im.astype(int)
     plt.close(fignum)
     plt.figure(fignum)
@@ -28,12 +30,13 @@ def viz_img(text_im, fignum=1):
     # plt.show(block=True)
 
 
-def prob(percent):
+def prob(percent, rng=random):
     """
     percent: 0 ~ 1, e.g: 如果 percent=0.1，有 10% 的可能性
+    rng: python random module or numpy random Generator
     """
     assert 0 <= percent <= 1
-    if random.uniform(0, 1) <= percent:
+    if rng.uniform(0, 1) <= percent:
         return True
     return False
 
@@ -76,22 +79,6 @@ def draw_bbox(img, bbox, color):
     return draw_box(img, pnts, color)
 
 
-def load_bgs(bg_dir):
-    dst = []
-
-    for root, sub_folder, file_list in os.walk(bg_dir):
-        for file_name in file_list:
-            image_path = os.path.join(root, file_name)
-
-            # For load non-ascii image_path on Windows
-            bg = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
-
-            dst.append(bg)
-
-    print("Background num: %d" % len(dst))
-    return dst
-
-
 def load_chars(filepath):
     if not os.path.exists(filepath):
         print("Chars file not exists.")
@@ -113,21 +100,100 @@ def md5(string):
     return m.hexdigest()
 
 
-def apply(cfg_item):
+def apply(cfg_item, rng=random):
     """
     :param cfg_item: a sub cfg item in default.yml, it should contain enable and fraction. such as
                 prydown:
                     enable: true
                     fraction: 0.03
+    :param rng: python random module or numpy random Generator
     :return: True/False
     """
 
-    if cfg_item.enable and prob(cfg_item.fraction):
+    if cfg_item.enable and prob(cfg_item.fraction, rng):
         return True
 
     return False
 
 
+def to_uint8(img):
+    """
+    Round and saturate image to uint8, uint8 image is returned as it is
+    """
+    if img.dtype == np.uint8:
+        return img
+    return np.clip(np.around(img), 0, 255).astype(np.uint8)
+
+
+# Max channels of an opencv image
+CV_MAX_CHANNELS = 512
+
+
+def apply_on_batch(func, imgs):
+    """
+    Apply a per channel opencv filter (e.g. cv2.GaussianBlur) on a batch of images with a few calls,
+    images are stacked as channels of one image.
+    :param imgs: array (N, H, W) or (N, H, W, C)
+    :return: array with same shape as imgs
+    """
+    stacked = np.moveaxis(imgs, 0, -1)
+    shape = stacked.shape
+    stacked = np.ascontiguousarray(stacked).reshape(shape[0], shape[1], -1)
+
+    outs = []
+    for start in range(0, stacked.shape[2], CV_MAX_CHANNELS):
+        out = func(np.ascontiguousarray(stacked[:, :, start:start + CV_MAX_CHANNELS]))
+        outs.append(out.reshape(shape[0], shape[1], -1))
+
+    out = outs[0] if len(outs) == 1 else np.concatenate(outs, axis=2)
+    return np.moveaxis(out.reshape(shape), -1, 0)
+
+
+def get_img_rng(seed, img_index):
+    """
+    Random generator of one image. Same (seed, img_index) always gives same image,
+    different img_index gives independent random streams.
+    """
+    return np.random.default_rng([img_index, seed])
+
+
+def get_img_rel_path(img_index, files_per_dir=0, ext='.jpg'):
+    """
+    Image path relative to output dir.
+    :param files_per_dir: if > 0, images are put in sub dirs named by img_index // files_per_dir,
+                          e.g. files_per_dir=1000: 00012/00012345.jpg
+    """
+    base_name = '{:08d}'.format(img_index) + ext
+    if files_per_dir <= 0:
+        return base_name
+    return os.path.join('{:05d}'.format(img_index // files_per_dir), base_name)
+
+
+def get_memory_usage():
+    """
+    :return: (rss, private) memory of current process in MB. private memory is not shared with parent
+             process after fork, it's None if /proc/self/smaps_rollup is not available
+    """
+    rss = None
+    private = None
+    if os.path.exists('/proc/self/smaps_rollup'):
+        private = 0
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith('Private_'):
+                    private += int(line.split()[1]) / 1024
+
+    if rss is None:
+        import resource
+        # peak rss, KB on linux, bytes on OS X
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if get_platform() == 'OS X':
+            rss /= 1024
+    return rss, private
+
+
 def get_platform():
     platforms = {
         'linux1': 'Linux',
@@ -12,133 +12,303 @@ os.environ['MKL_NUM_THREADS'] = '1'
 os.environ['VECLIB_MAXIMUM_THREADS'] = '1'
 os.environ['NUMEXPR_NUM_THREADS'] = '1'
 
-import traceback
+import gc
+import time
 import numpy as np
 
 import multiprocessing as mp
-from itertools import repeat
+from multiprocessing.util import Finalize
 
-import cv2
-
-from libs.config import load_config
 from libs.timer import Timer
+from libs.progress import ProgressReporter
+from libs.manifest import Manifest, count_lines
+from libs.image_writer import check_encode_params
 from parse_args import parse_args
 import libs.utils as utils
-import libs.font_utils as font_utils
-from textrenderer.corpus.corpus_utils import corpus_factory
-from textrenderer.renderer import Renderer
-from tenacity import retry
-
-lock = mp.Lock()
-counter = mp.Value('i', 0)
-STOP_TOKEN = 'kill'
-
-flags = parse_args()
-cfg = load_config(flags.config_file)
-
-fonts = font_utils.get_font_paths_from_list(flags.fonts_list)
-bgs = utils.load_bgs(flags.bg_dir)
-
-corpus = corpus_factory(flags.corpus_mode, flags.chars_file, flags.corpus_dir, flags.length)
-
-renderer = Renderer(corpus, fonts, bgs, cfg,
-                    height=flags.img_height,
-                    width=flags.img_width,
-                    clip_max_chars=flags.clip_max_chars,
-                    debug=flags.debug,
-                    gpu=flags.gpu,
-                    strict=flags.strict)
-
-
-def start_listen(q, fname):
-    """ listens for messages on the q, writes to file. """
-
-    f = open(fname, mode='a', encoding='utf-8')
-    while 1:
-        m = q.get()
-        if m == STOP_TOKEN:
-            break
-        try:
-            f.write(str(m) + '\n')
-        except:
-            traceback.print_exc()
+from libs.sink.sink_utils import get_sink_class, sink_factory
+from textrenderer.stream import build_renderer, gen_batch, FailureLog
+
+# Nothing is loaded at import time, so spawned workers only do what init_worker() asks
+flags = None
+renderer = None
+sink = None
+failures = None
+
+# Failed render attempts are dumped to save_dir/failures/{worker}.jsonl with --dump_failures
+FAILURE_DIR_NAME = 'failures'
+
+# Memory usage before and after init_worker(), reported with first chunk of the worker
+worker_memory = None
+
+
+def get_renderer_kwargs(flags):
+    return dict(config_file=flags.config_file,
+                fonts_list=flags.fonts_list,
+                bg_dir=flags.bg_dir,
+                corpus_mode=flags.corpus_mode,
+                chars_file=flags.chars_file,
+                corpus_dir=flags.corpus_dir,
+                length=flags.length,
+                img_height=flags.img_height,
+                img_width=flags.img_width,
+                clip_max_chars=flags.clip_max_chars,
+                debug=flags.debug,
+                gpu=flags.gpu,
+                strict=flags.strict,
+                text_layer=flags.text_layer,
+                bg_cache_size=flags.bg_cache_size)
+
+
+def generate_imgs(start, end):
+    """
+    Render images of a chunk as one batch, so output effects run on the whole chunk
+    """
+    global flags
+    imgs, words = gen_batch(renderer, range(start, end), flags.max_retries, failures)
+
+    for img_index, im, word in zip(range(start, end), imgs, words):
+        if not flags.viz:
+            sink.write(img_index, im, word)
+        else:
+            utils.viz_img(im)
+
+
+def init_worker(worker_flags, run, seed, start_index):
+    """
+    Called by init_pool_worker() in workers, or in main process in inline mode. With fork start method,
+    renderer is built in main process and inherited by workers, otherwise every worker builds its own renderer here.
+    :param start_index: first image index of save_dir, shards of --num_shards have different start index
+    """
+    global flags, renderer, sink, failures, worker_memory
+    memory_before = utils.get_memory_usage()
+    gc.enable()
+
+    flags = worker_flags
+    if renderer is None:
+        renderer = build_renderer(**get_renderer_kwargs(flags))
+    renderer.seed = seed
+
+    # Shard dirs rendered on different hosts may reuse pids, start index keeps file names unique
+    # when they are merged by tools/merge_shards.py
+    name = 'i%d_run%d_%d' % (start_index, run, os.getpid())
+    if not flags.viz:
+        sink = sink_factory(flags.output_mode, flags.save_dir, name, flags)
+
+    dump_path = None
+    if flags.dump_failures:
+        dump_path = os.path.join(flags.save_dir, FAILURE_DIR_NAME, name + '.jsonl')
+    failures = FailureLog(dump_path)
+
+    worker_memory = [memory_before, utils.get_memory_usage()]
+
+
+def init_pool_worker(worker_flags, run, seed, start_index):
+    """
+    Pool initializer. Sink of the worker is closed when the worker process exits, so its threads and
+    files are released without relying on interpreter teardown.
+    """
+    init_worker(worker_flags, run, seed, start_index)
+    if sink is not None:
+        Finalize(sink, sink.close, exitpriority=10)
+
+
+def generate_chunk(chunk):
+    """
+    Generate images with continuous indexes in one task, so dispatch cost is paid per chunk instead of per image
+    :param chunk: (start, end) image index range, end is excluded
+    :return: dict
+        start, end: chunk
+        seconds: time used by this chunk
+        shards: shard files of this worker written by this chunk and their size after this chunk
+        failures: failed render attempts of this chunk by cause
+        bg_cache: background cache hits and misses of this chunk
+        pid: worker process id
+        memory: memory usage of worker before init, after init and after this chunk. Only set for first chunk
+    """
+    global worker_memory
+    start, end = chunk
+    t = time.time()
+    generate_imgs(start, end)
+
+    result = dict(start=start, end=end, seconds=time.time() - t, pid=os.getpid(), shards=None,
+                  failures=failures.pop_counts(), bg_cache=renderer.bgs.pop_stats(), memory=None)
+
+    # Chunk is finished only when all its images are on disk
+    if sink is not None:
+        result['shards'] = sink.flush()
+
+    if worker_memory is not None:
+        result['memory'] = worker_memory + [utils.get_memory_usage()]
+        worker_memory = None
+
+    return result
+
+
+def format_memory(memory):
+    rss, private = memory
+    if private is None:
+        return "rss %.1f MB" % rss
+    return "rss %.1f MB, private %.1f MB" % (rss, private)
+
+
+def report_memory(name, memory):
+    print("%s memory: %s" % (name, ' -> '.join([format_memory(m) for m in memory])))
+
+
+def restore_progress(label_path):
+    """
+    Load progress manifest in save_dir. Resume unfinished job if there is one,
+    otherwise start a new job after exist images.
+    """
+    manifest = Manifest.load(flags.save_dir)
+    if flags.start_index is not None:
+        return restore_index_range(manifest)
+
+    if manifest.exists() and not manifest.is_finished():
+        print('Resume unfinished job in %s. Next index %d, end index %d' % (
+            flags.save_dir, manifest.next_index, manifest.end_index))
+        return manifest
 
-        with lock:
-            if counter.value % 1000 == 0:
-                f.flush()
-    f.close()
+    # 如果目标目录存在 labels.txt 则向该目录中追加图片
+    if manifest.exists():
+        start_index = manifest.end_index
+    elif os.path.exists(label_path):
+        # labels.txt generated without progress manifest
+        start_index = count_lines(label_path)
+    else:
+        start_index = 0
 
+    if start_index != 0:
+        print('Generate more text images in %s. Start index %d' % (flags.save_dir, start_index))
+    else:
+        print('Generate text images in %s' % flags.save_dir)
 
-@retry
-def gen_img_retry(renderer, img_index):
-    try:
-        return renderer.gen_img(img_index)
-    except Exception as e:
-        print("Retry gen_img: %s" % str(e))
-        traceback.print_exc()
-        raise Exception
+    manifest.next_index = start_index
+    manifest.end_index = start_index + flags.num_img
+    return manifest
+
+
+def restore_index_range(manifest):
+    """
+    Output dir of a fixed index range (--start_index or --num_shards) only contains images in this range
+    """
+    if not manifest.exists():
+        print('Generate text images [%d, %d) in %s' % (flags.start_index, flags.end_index, flags.save_dir))
+        manifest.start_index = flags.start_index
+        manifest.next_index = flags.start_index
+        manifest.end_index = flags.end_index
+        return manifest
+
+    if manifest.start_index != flags.start_index or manifest.end_index != flags.end_index:
+        print('Index range [%d, %d) is different from images [%d, %d) in %s' % (
+            flags.start_index, flags.end_index, manifest.start_index, manifest.end_index, flags.save_dir))
+        exit(-1)
+
+    if manifest.is_finished():
+        print('Images [%d, %d) already generated in %s' % (flags.start_index, flags.end_index, flags.save_dir))
+    else:
+        print('Resume unfinished job in %s. Next index %d, end index %d' % (
+            flags.save_dir, manifest.next_index, manifest.end_index))
+    return manifest
 
 
-def generate_img(img_index, q=None):
-    global flags, lock, counter
-    # Make sure different process has different random seed
-    np.random.seed()
+def get_seed(manifest):
+    """
+    Images in a dir should always use same seed, so all of them can be regenerated from the manifest
+    """
+    if has_images(manifest) and manifest.seed is not None:
+        if flags.seed is not None and flags.seed != manifest.seed:
+            print('seed %d is different from exist images (%d) in %s' % (flags.seed, manifest.seed,
+                                                                           flags.save_dir))
+            exit(-1)
+        return manifest.seed
 
-    im, word = gen_img_retry(renderer, img_index)
+    if flags.seed is not None:
+        return flags.seed
 
-    base_name = '{:08d}'.format(img_index)
+    if manifest.seed is not None:
+        return manifest.seed
 
-    if not flags.viz:
-        fname = os.path.join(flags.save_dir, base_name + '.jpg')
-        cv2.imwrite(fname, im)
-
-        label = "{} {}".format(base_name, word)
-
-        if q is not None:
-            q.put(label)
-
-        with lock:
-            counter.value += 1
-            print_end = '\n' if counter.value == flags.num_img else '\r'
-            if counter.value % 100 == 0 or counter.value == flags.num_img:
-                print("{}/{} {:2d}%".format(counter.value,
-                                            flags.num_img,
-                                            int(counter.value / flags.num_img * 100)),
-                      end=print_end)
-    else:
-        utils.viz_img(im)
+    return np.random.SeedSequence().entropy
 
 
-def sort_labels(tmp_label_fname, label_fname):
-    lines = []
-    with open(tmp_label_fname, mode='r', encoding='utf-8') as f:
-        lines = f.readlines()
+def has_images(manifest):
+    return manifest.next_index > manifest.start_index or len(manifest.done_chunks) > 0
 
-    lines = sorted(lines)
-    with open(label_fname, mode='w', encoding='utf-8') as f:
-        for line in lines:
-            f.write(line[9:])
 
+def restore_layout(manifest, name, default):
+    """
+    Images in a dir should always use same layout, e.g. files_per_dir, output_mode and img_format
+    :return: value of flag name, flag value is None means using layout of exist images
+    """
+    value = getattr(flags, name)
+    if not has_images(manifest):
+        return default if value is None else value
 
-def restore_exist_labels(label_path):
-    # 如果目标目录存在 labels.txt 则向该目录中追加图片
-    start_index = 0
-    if os.path.exists(label_path):
-        start_index = len(utils.load_chars(label_path))
-        print('Generate more text images in %s. Start index %d' % (flags.save_dir, start_index))
-    else:
-        print('Generate text images in %s' % flags.save_dir)
-    return start_index
+    if value is not None and value != getattr(manifest, name):
+        print('%s %s is different from exist images (%s) in %s' % (
+            name, value, getattr(manifest, name), flags.save_dir))
+        exit(-1)
+    return getattr(manifest, name)
 
 
 def get_num_processes(flags):
     processes = flags.num_processes
     if processes is None:
-        processes = max(os.cpu_count(), 2)
+        processes = os.cpu_count()
     return processes
 
 
-if __name__ == "__main__":
+def generate_inline(manifest):
+    """
+    Generate all pending chunks in main process, no worker process is created.
+    Used by --num_processes 1, small jobs and profiling
+    :return: generator of chunk results
+    """
+    init_worker(flags, manifest.run, manifest.seed, manifest.start_index)
+    try:
+        for chunk in manifest.pending_chunks(flags.chunk_size):
+            yield generate_chunk(chunk)
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+def generate_pool(manifest):
+    """
+    Generate pending chunks in worker processes
+    :return: generator of chunk results, in finish order
+    """
+    global renderer
+    memory = [utils.get_memory_usage()]
+    # Objects created from now on are never collected before fork, gc is enabled again in workers
+    gc.disable()
+    if mp.get_start_method() == 'fork':
+        # Build renderer once, workers share loaded fonts, background index and corpus by copy-on-write
+        renderer = build_renderer(**get_renderer_kwargs(flags))
+        if hasattr(gc, 'freeze'):
+            # Move all objects to permanent generation, so gc in workers will not touch them
+            # and copy their memory pages
+            gc.freeze()
+        memory.append(utils.get_memory_usage())
+    report_memory('Main process', memory)
+
+    with mp.Pool(processes=get_num_processes(flags), initializer=init_pool_worker,
+                 initargs=(flags, manifest.run, manifest.seed, manifest.start_index)) as pool:
+        gc.enable()
+
+        chunks = manifest.pending_chunks(flags.chunk_size)
+        for chunk_result in pool.imap_unordered(generate_chunk, chunks):
+            yield chunk_result
+
+        pool.close()
+        pool.join()
+
+
+def main():
+    global flags
+    flags = parse_args()
+
     # It seems there are some problems when using opencv in multiprocessing fork way
     # https://github.com/opencv/opencv/issues/5150#issuecomment-161371095
     # https://github.com/pytorch/pytorch/issues/3492#issuecomment-382660636
@@ -148,26 +318,55 @@ if __name__ == "__main__":
     if flags.viz == 1:
         flags.num_processes = 1
 
-    tmp_label_path = os.path.join(flags.save_dir, 'tmp_labels.txt')
     label_path = os.path.join(flags.save_dir, 'labels.txt')
 
-    manager = mp.Manager()
-    q = manager.Queue()
+    manifest = restore_progress(label_path)
+    manifest.seed = get_seed(manifest)
+    print('Random seed: %d' % manifest.seed)
+    for name, default in [('files_per_dir', 0), ('output_mode', 'files'), ('img_format', 'jpg')]:
+        value = restore_layout(manifest, name, default)
+        setattr(manifest, name, value)
+        setattr(flags, name, value)
+    # img_format may be restored from exist images, check encode params again with it
+    encode_error = check_encode_params(flags.img_format, flags.img_quality, flags.png_compression)
+    if encode_error is not None:
+        print(encode_error)
+        exit(-1)
+    sink_class = get_sink_class(flags.output_mode)
+    if not flags.viz:
+        sink_class.rollback(flags.save_dir, manifest)
+        manifest.run += 1
+        manifest.save()
+        sink_class.prepare(flags.save_dir, manifest, flags)
 
-    start_index = restore_exist_labels(label_path)
+    if flags.dump_failures:
+        os.makedirs(os.path.join(flags.save_dir, FAILURE_DIR_NAME), exist_ok=True)
 
     timer = Timer(Timer.SECOND)
     timer.start()
-    with mp.Pool(processes=get_num_processes(flags)) as pool:
-        if not flags.viz:
-            pool.apply_async(start_listen, (q, tmp_label_path))
+    progress = ProgressReporter(manifest.num_pending())
+    if get_num_processes(flags) == 1:
+        chunk_results = generate_inline(manifest)
+    else:
+        chunk_results = generate_pool(manifest)
 
-        pool.starmap(generate_img, zip(range(start_index, start_index + flags.num_img), repeat(q)))
+    for chunk_result in chunk_results:
+        if chunk_result['memory'] is not None:
+            report_memory('Worker %d' % chunk_result['pid'], chunk_result['memory'])
 
-        q.put(STOP_TOKEN)
-        pool.close()
-        pool.join()
+        progress.update(chunk_result)
+
+        if not flags.viz:
+            manifest.mark_done(chunk_result['start'], chunk_result['end'], chunk_result['shards'])
+            manifest.save()
     timer.end("Finish generate data")
+    progress.summary()
 
     if not flags.viz:
-        sort_labels(tmp_label_path, label_path)
+        sink_class.finalize(flags.save_dir, manifest)
+        manifest.shards = {}
+        manifest.save()
+
+
+if __name__ == "__main__":
+    main()
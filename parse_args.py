@@ -2,6 +2,9 @@
 import argparse
 import os
 
+from textrenderer.bg_store import DEFAULT_BG_CACHE_SIZE
+from libs.image_writer import check_encode_params
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -32,6 +35,10 @@ def parse_args():
                         help="Some text images(according to your config in yaml file) will"
                              "use pictures in this folder as background")
 
+    parser.add_argument('--bg_cache_size', type=int, default=DEFAULT_BG_CACHE_SIZE,
+                        help='Backgrounds are decoded when used, at most this number of decoded backgrounds '
+                             'are kept in memory by each process. 0 to disable cache')
+
     parser.add_argument('--corpus_dir', type=str, default="./data/corpus",
                         help='When corpus_mode is chn or eng, text on image will randomly selected from corpus.'
                              'Recursively find all txt file in corpus_dir')
@@ -53,14 +60,115 @@ def parse_args():
     parser.add_argument('--strict', action='store_true', default=False,
                         help="check font supported chars when generating images")
 
+    parser.add_argument('--text_layer', action='store_true', default=False,
+                        help="Draw text alone on a tight mask, only warp the mask and blend it onto a background "
+                             "generated at output size. Faster, background has no perspective transform. "
+                             "line, curve and seamless_clone in config file are not supported")
+
+    parser.add_argument('--max_retries', type=int, default=100,
+                        help="An image is rendered again with new random values when it failed (e.g. font does "
+                             "not support the text in strict mode). Job stops if an image failed more than max_retries "
+                             "times in a row")
+
+    parser.add_argument('--dump_failures', action='store_true', default=False,
+                        help="Save every failed render attempt (image index, cause, word, font...) as json lines "
+                             "in output_dir/{tag}/failures for inspection")
+
     parser.add_argument('--gpu', action='store_true', default=False, help="use CUDA to generate image")
 
     parser.add_argument('--num_processes', type=int, default=None,
-                        help="Number of processes to generate image. If None, use all cpu cores")
+                        help="Number of processes to generate image. If 1, images are generated in main process "
+                             "without multiprocessing. If None, use all cpu cores")
+
+    parser.add_argument('--chunk_size', type=int, default=100,
+                        help="Number of continuous image indexes handed to a worker process as one task. "
+                             "Larger value reduces per-image dispatch overhead. Images of a chunk are rendered as "
+                             "one batch, output effects are applied on the whole batch")
+
+    parser.add_argument('--write_threads', type=int, default=0,
+                        help="Background threads per worker process to encode and write images, "
+                             "so rendering does not wait on encoding and disk. If 0, write synchronously")
+
+    parser.add_argument('--write_queue_size', type=int, default=16,
+                        help="Max images per worker process waiting to be written by background threads")
+
+    parser.add_argument('--files_per_dir', type=int, default=None,
+                        help="If > 0, images are saved in sub dirs of output dir, each sub dir contains "
+                             "files_per_dir images, e.g. 1000: 00012/00012345.jpg. "
+                             "If None, use layout of exist images in output dir, or 0 (no sub dir) for a new dir")
+
+    parser.add_argument('--img_format', type=str, default=None, choices=['jpg', 'png', 'webp', 'npy'],
+                        help="Encoding of output images, npy is uncompressed uint8 numpy array. "
+                             "If None, use format of exist images in output dir, or jpg for a new dir. "
+                             "Run tools/bench_encode.py to compare encode time and size")
+
+    parser.add_argument('--img_quality', type=int, default=None,
+                        help="jpg quality in [0, 100], webp quality in [1, 101], webp is lossless when 101. "
+                             "If None, use opencv default")
+
+    parser.add_argument('--png_compression', type=int, default=None,
+                        help="png compression level in [0, 9], higher is smaller but slower. "
+                             "If None, use opencv default")
+
+    parser.add_argument('--output_mode', type=str, default=None, choices=['files', 'tar', 'tfrecord', 'memmap'],
+                        help="files: one image file per image and a labels.txt. "
+                             "tar: WebDataset style tar shards of {index}.jpg and {index}.txt pairs. "
+                             "tfrecord: TFRecord shards with same features as tools/make_tfrecord.py. "
+                             "memmap: one uint8 images.npy array filled in place by workers and a labels.npy, "
+                             "needs fixed img_width. "
+                             "If None, use output mode of exist images in output dir, or files for a new dir")
+
+    parser.add_argument('--shard_size_mb', type=int, default=1024,
+                        help="Max size of a tar/tfrecord shard, every worker process writes its own shards")
+
+    parser.add_argument('--tfrecord_raw', action='store_true', default=False,
+                        help="Save jpg bytes as image feature of tfrecord, same as --raw of tools/make_tfrecord.py. "
+                             "Otherwise save float32 gray pixels")
+
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Every image is rendered with a random generator derived from (seed, image index), "
+                             "so any image can be regenerated. If None, a random seed is picked and saved "
+                             "in progress manifest")
+
+    parser.add_argument('--start_index', type=int, default=None,
+                        help="Render global image indexes [start_index, start_index + num_img) only. "
+                             "If None, append images after exist images in output dir")
+
+    parser.add_argument('--num_shards', type=int, default=1,
+                        help="Split global image indexes into num_shards disjoint slices, "
+                             "each node renders one slice into output_dir/{tag}/shard_{shard_index}. "
+                             "Use tools/merge_shards.py to stitch shards into one dataset. "
+                             "--seed is required, all shards should use the same seed")
+
+    parser.add_argument('--shard_index', type=int, default=0, help="Slice rendered by this node")
 
     flags, _ = parser.parse_known_args()
     flags.save_dir = os.path.join(flags.output_dir, flags.tag)
 
+    if flags.seed is not None and flags.seed < 0:
+        parser.error("seed min value is 0")
+
+    if flags.num_shards < 1 or not 0 <= flags.shard_index < flags.num_shards:
+        parser.error("shard_index should in [0, num_shards)")
+
+    # Every shard would pick its own random seed, merged dataset could not be reproduced
+    if flags.num_shards > 1 and flags.seed is None:
+        parser.error("--seed is required when num_shards > 1")
+
+    if flags.start_index is not None and flags.start_index < 0:
+        parser.error("start_index min value is 0")
+
+    # Fixed index range of this node
+    flags.end_index = None
+    if flags.start_index is not None or flags.num_shards > 1:
+        global_start = flags.start_index or 0
+        flags.start_index = global_start + flags.num_img * flags.shard_index // flags.num_shards
+        flags.end_index = global_start + flags.num_img * (flags.shard_index + 1) // flags.num_shards
+        flags.num_img = flags.end_index - flags.start_index
+
+        if flags.num_shards > 1:
+            flags.save_dir = os.path.join(flags.save_dir, 'shard_%05d' % flags.shard_index)
+
     if os.path.exists(flags.bg_dir):
         num_bg = len(os.listdir(flags.bg_dir))
         flags.num_bg = num_bg
@@ -68,8 +176,24 @@ def parse_args():
     if not os.path.exists(flags.save_dir):
         os.makedirs(flags.save_dir)
 
-    if flags.num_processes == 1:
-        parser.error("num_processes min value is 2")
+    if flags.num_processes is not None and flags.num_processes < 1:
+        parser.error("num_processes min value is 1")
+
+    if flags.max_retries < 0:
+        parser.error("max_retries min value is 0")
+
+    if flags.bg_cache_size < 0:
+        parser.error("bg_cache_size min value is 0")
+
+    encode_error = check_encode_params(flags.img_format, flags.img_quality, flags.png_compression)
+    if encode_error is not None:
+        parser.error(encode_error)
+
+    if flags.chunk_size < 1:
+        parser.error("chunk_size min value is 1")
+
+    if flags.shard_size_mb < 1:
+        parser.error("shard_size_mb min value is 1")
 
     return flags
 
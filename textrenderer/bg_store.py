@@ -0,0 +1,76 @@
+import os
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from textrenderer.errors import BackgroundError
+
+# Decoded backgrounds kept in memory by default, per process
+DEFAULT_BG_CACHE_SIZE = 128
+
+
+class BackgroundStore(object):
+    """
+    Background images under bg_dir. Only file paths are indexed at startup, images are decoded when
+    they are used. At most cache_size decoded (and color converted) backgrounds are kept, least recently
+    used one is dropped first.
+    """
+
+    def __init__(self, bg_dir, gray=False, cache_size=DEFAULT_BG_CACHE_SIZE):
+        """
+        :param gray: convert backgrounds to gray when they are decoded, otherwise BGR
+        :param cache_size: max number of decoded backgrounds kept in memory, 0 to disable cache
+        """
+        self.gray = gray
+        self.cache_size = cache_size
+        # Sorted, so an index is the same background on every machine
+        self.paths = sorted([os.path.join(root, file_name)
+                             for root, _, file_list in os.walk(bg_dir) for file_name in file_list])
+
+        # index -> decoded image
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        print("Background num: %d" % len(self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        bg = self.cache.get(index)
+        if bg is not None:
+            self.hits += 1
+            self.cache.move_to_end(index)
+            return bg
+
+        self.misses += 1
+        bg = self.load(index)
+
+        if self.cache_size > 0:
+            self.cache[index] = bg
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return bg
+
+    def load(self, index):
+        image_path = self.paths[index]
+
+        # For load non-ascii image_path on Windows
+        bg = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bg is None:
+            raise BackgroundError('Failed to decode background %s' % image_path, bg_path=image_path)
+
+        if self.gray:
+            bg = cv2.cvtColor(bg, cv2.COLOR_BGR2GRAY)
+        return bg
+
+    def pop_stats(self):
+        """
+        :return: dict of cache hits and misses since last call
+        """
+        stats = dict(hits=self.hits, misses=self.misses)
+        self.hits = 0
+        self.misses = 0
+        return stats
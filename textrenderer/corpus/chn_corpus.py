@@ -1,5 +1,4 @@
 import random
-import numpy as np
 
 from textrenderer.corpus.corpus import Corpus
 
@@ -29,7 +28,8 @@ class ChnCorpus(Corpus):
 
             # 所有行合并成一行
             split_chars = [',', '，', '：', '-', ' ', ';', '。']
-            splitchar = random.choice(split_chars)
+            # Seed by file path, so every process loads the same corpus
+            splitchar = random.Random(p).choice(split_chars)
             whole_line = splitchar.join(lines)
 
             # 在 crnn/libs/label_converter 中 encode 时还会进行过滤
@@ -38,11 +38,11 @@ class ChnCorpus(Corpus):
             if len(whole_line) > self.length:
                 self.corpus.append(whole_line)
 
-    def get_sample(self, img_index):
+    def get_sample(self, img_index, rng):
         # 每次 gen_word，随机选一个预料文件，随机获得长度为 word_length 的字符
-        line = random.choice(self.corpus)
+        line = self.corpus[rng.integers(len(self.corpus))]
 
-        start = np.random.randint(0, len(line) - self.length)
+        start = rng.integers(0, len(line) - self.length)
 
         word = line[start:start + self.length]
         return word
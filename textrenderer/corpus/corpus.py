@@ -23,9 +23,10 @@ class Corpus(object):
         pass
 
     @abstractmethod
-    def get_sample(self, img_index):
+    def get_sample(self, img_index, rng):
         """
         Get word line from corpus in memory
+        :param rng: numpy random Generator of current image
         :return: string
         """
         pass
@@ -1,5 +1,4 @@
 from textrenderer.corpus.corpus import Corpus
-import numpy as np
 
 
 class EngCorpus(Corpus):
@@ -25,8 +24,8 @@ class EngCorpus(Corpus):
                         self.corpus.append(word)
             print("Word count {}".format(len(self.corpus)))
 
-    def get_sample(self, img_index):
-        start = np.random.randint(0, len(self.corpus) - self.length + 1)
+    def get_sample(self, img_index, rng):
+        start = rng.integers(0, len(self.corpus) - self.length + 1)
         words = self.corpus[start:start + self.length]
         word = ' '.join(words)
         return word
@@ -1,5 +1,4 @@
 from textrenderer.corpus.corpus import Corpus
-import numpy as np
 
 
 class ListCorpus(Corpus):
@@ -20,6 +19,6 @@ class ListCorpus(Corpus):
 
         print("Total lines: {}".format(len(self.corpus)))
 
-    def get_sample(self, img_index):
+    def get_sample(self, img_index, rng):
         index = img_index % len(self.corpus)
         return self.corpus[index]
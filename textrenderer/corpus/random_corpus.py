@@ -1,5 +1,3 @@
-import random
-
 from textrenderer.corpus.corpus import Corpus
 
 
@@ -11,9 +9,8 @@ class RandomCorpus(Corpus):
     def load(self):
         pass
 
-    def get_sample(self, img_index):
-        word = ''
-        for _ in range(self.length):
-            word += random.choice(self.charsets)
+    def get_sample(self, img_index, rng):
+        chars_index = rng.integers(0, len(self.charsets), self.length)
+        word = ''.join([self.charsets[i] for i in chars_index])
         return word
 
@@ -0,0 +1,56 @@
+class RenderError(Exception):
+    """
+    An image can not be rendered with current random values, it's retried with values drawn next
+    from the same random generator.
+
+    :param inputs: values which caused the failure, e.g. word and font, saved by --dump_failures
+    """
+    cause = 'other'
+
+    def __init__(self, msg, **inputs):
+        super().__init__(msg)
+        self.inputs = inputs
+
+
+class FontCoverageError(RenderError):
+    """
+    Strict mode, picked font does not support some chars of the word
+    """
+    cause = 'font_coverage'
+
+
+class EmptyCropError(RenderError):
+    """
+    Text or crop box is empty, e.g. empty word or text transformed out of the image
+    """
+    cause = 'empty_crop'
+
+
+class WarpError(RenderError):
+    """
+    Perspective transform produced an invalid image or text box
+    """
+    cause = 'warp'
+
+
+class BackgroundError(RenderError):
+    """
+    Background image file can not be decoded
+    """
+    cause = 'background'
+
+
+class RetryLimitError(RenderError):
+    """
+    Image failed max_retries times in a row
+    """
+    cause = 'retry_limit'
+
+
+def get_cause(e):
+    """
+    :return: failure cause name of an exception, unexpected exceptions are 'other'
+    """
+    if isinstance(e, RenderError):
+        return e.cause
+    return RenderError.cause
@@ -1,6 +1,6 @@
-import random
 import cv2
-import numpy as np
+
+from textrenderer.plan import Choice, ColorChoice
 
 
 class LineState(object):
@@ -28,35 +28,7 @@ class Liner(object):
         self.linestate: LineState = LineState()
         self.cfg = cfg
 
-    def get_line_color(self):
-        p = []
-        colors = []
-        for k, v in self.cfg.line_color.items():
-            if k == 'enable':
-                continue
-            p.append(v.fraction)
-            colors.append(k)
-
-        # pick color by fraction
-        color_name = np.random.choice(colors, p=p)
-        l_boundary = self.cfg.line_color[color_name].l_boundary
-        h_boundary = self.cfg.line_color[color_name].h_boundary
-        # random color by low and high RGB boundary
-        r = np.random.randint(l_boundary[0], h_boundary[0])
-        g = np.random.randint(l_boundary[1], h_boundary[1])
-        b = np.random.randint(l_boundary[2], h_boundary[2])
-        return b, g, r
-
-    def get_random_point(self, img):
-        return (int(np.random.randint(img.shape[1])), int(np.random.randint(img.shape[0])))
-
-
-    def apply(self, word_img, text_box_pnts, word_color):
-        """
-        :param word_img:  word image with big background
-        :param text_box_pnts: left-top, right-top, right-bottom, left-bottom of text word
-        :return:
-        """
+        # Choices compiled from config and LineState
         line_p = []
         funcs = []
 
@@ -77,20 +49,48 @@ class Liner(object):
             line_p.append(self.cfg.line.random_over.fraction)
             funcs.append(self.apply_random_over)
 
-        if len(line_p) == 0:
+        self.line_choice = Choice(funcs, line_p) if funcs else None
+        self.line_color_choice = ColorChoice(self.cfg.line_color)
+        self.colored_line = self.cfg.line_color.enable or self.cfg.font_color.enable
+
+        ls = self.linestate
+        self.middleline_thickness = Choice(ls.middleline_thickness, ls.middleline_thickness_p)
+        self.over_line_count = Choice(ls.over_line_count, ls.over_line_count_p)
+        self.over_line_transparency = Choice(ls.over_line_transparency, ls.over_line_transparency_p)
+        self.over_line_thickness = Choice(ls.over_line_thickness, ls.over_line_thickness_p)
+
+    def get_line_color(self, rng):
+        # pick color by fraction, random color by low and high RGB boundary
+        return self.line_color_choice.draw(rng)
+
+    def get_random_point(self, img, rng):
+        return (int(rng.integers(img.shape[1])), int(rng.integers(img.shape[0])))
+
+    def choice(self, options, rng):
+        return options[rng.integers(len(options))]
+
+
+    def apply(self, word_img, text_box_pnts, word_color, rng):
+        """
+        :param word_img:  word image with big background
+        :param text_box_pnts: left-top, right-top, right-bottom, left-bottom of text word
+        :param rng: numpy random Generator of current image
+        :return:
+        """
+        if self.line_choice is None:
             return word_img, text_box_pnts
 
-        line_effect_func = np.random.choice(funcs, p=line_p)
+        line_effect_func = self.line_choice.draw(rng)
 
-        if self.cfg.line_color.enable or self.cfg.font_color.enable:
-            line_color = self.get_line_color()
+        if self.colored_line:
+            line_color = self.get_line_color(rng)
         else:
-            line_color = word_color + random.randint(0, 10)
+            line_color = word_color + int(rng.integers(0, 11))
 
-        return line_effect_func(word_img, text_box_pnts, line_color)
+        return line_effect_func(word_img, text_box_pnts, line_color, rng)
 
-    def apply_under_line(self, word_img, text_box_pnts, line_color):
-        y_offset = random.choice([0, 1])
+    def apply_under_line(self, word_img, text_box_pnts, line_color, rng):
+        y_offset = int(rng.integers(0, 2))
 
         text_box_pnts[2][1] += y_offset
         text_box_pnts[3][1] += y_offset
@@ -104,20 +104,20 @@ class Liner(object):
 
         return dst, text_box_pnts
 
-    def apply_table_line(self, word_img, text_box_pnts, line_color):
+    def apply_table_line(self, word_img, text_box_pnts, line_color, rng):
         """
         共有 8 种可能的画法，横线横穿整张 word_img
         0/1/2/3: 仅单边（左上右下）
         4/5/6/7: 两边都有线（左上，右上，右下，左下）
         """
         dst = word_img
-        option = random.choice(self.linestate.tableline_options)
-        thickness = random.choice(self.linestate.tableline_thickness)
+        option = self.choice(self.linestate.tableline_options, rng)
+        thickness = self.choice(self.linestate.tableline_thickness, rng)
 
-        top_y_offset = random.choice(self.linestate.tableline_y_offsets)
-        bottom_y_offset = random.choice(self.linestate.tableline_y_offsets)
-        left_x_offset = random.choice(self.linestate.tableline_x_offsets)
-        right_x_offset = random.choice(self.linestate.tableline_x_offsets)
+        top_y_offset = self.choice(self.linestate.tableline_y_offsets, rng)
+        bottom_y_offset = self.choice(self.linestate.tableline_y_offsets, rng)
+        left_x_offset = self.choice(self.linestate.tableline_x_offsets, rng)
+        right_x_offset = self.choice(self.linestate.tableline_x_offsets, rng)
 
         def is_top():
             return option in [1, 4, 5]
@@ -181,10 +181,10 @@ class Liner(object):
 
         return dst, text_box_pnts
 
-    def apply_middle_line(self, word_img, text_box_pnts, line_color):
+    def apply_middle_line(self, word_img, text_box_pnts, line_color, rng):
         y_center = int((text_box_pnts[0][1] + text_box_pnts[3][1]) / 2)
 
-        thickness = np.random.choice(self.linestate.middleline_thickness, p=self.linestate.middleline_thickness_p)
+        thickness = int(self.middleline_thickness.draw(rng))
 
         dst = cv2.line(word_img,
                        (text_box_pnts[0][0], y_center),
@@ -195,24 +195,24 @@ class Liner(object):
 
         return dst, text_box_pnts
 
-    def apply_random_over(self, word_img, text_box_pnts, line_color):
-        count = int(np.random.choice(self.linestate.over_line_count, p=self.linestate.over_line_count_p))
+    def apply_random_over(self, word_img, text_box_pnts, line_color, rng):
+        count = int(self.over_line_count.draw(rng))
 
         dst = word_img
         # Iterating over number of lines 
         for i in range(count):
 
-            trans = np.random.choice(self.linestate.over_line_transparency, p=self.linestate.over_line_transparency_p)
+            trans = self.over_line_transparency.draw(rng)
 
-            thickness = np.random.choice(self.linestate.over_line_thickness, p=self.linestate.over_line_thickness_p)
+            thickness = int(self.over_line_thickness.draw(rng))
 
             trans = int((trans/100)*255)
 
-            color = self.get_line_color()
+            color = self.get_line_color(rng)
             color = (*color, trans) 
 
-            pt1 = self.get_random_point(word_img)
-            pt2 = self.get_random_point(word_img)
+            pt1 = self.get_random_point(word_img, rng)
+            pt2 = self.get_random_point(word_img, rng)
 
             dst = cv2.line(dst,
                             pt1,
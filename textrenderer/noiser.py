@@ -1,17 +1,22 @@
 import numpy as np
 import cv2
 
+from libs.utils import to_uint8
+from textrenderer.plan import Choice
+
+
+def add_noise(img, noise):
+    """
+    Add float noise to uint8 image, noise is rounded to int16 and result is saturated to uint8
+    """
+    return cv2.add(img, np.around(noise).astype(np.int16), dtype=cv2.CV_8U)
+
 
 # https://stackoverflow.com/questions/22937589/how-to-add-noise-gaussian-salt-and-pepper-etc-to-image-in-python-with-opencv
 class Noiser(object):
     def __init__(self, cfg):
         self.cfg = cfg
 
-    def apply(self, img):
-        """
-        :param img:  word image with big background
-        """
-
         p = []
         funcs = []
         if self.cfg.noise.gauss.enable:
@@ -30,65 +35,70 @@ class Noiser(object):
             p.append(self.cfg.noise.poisson.fraction)
             funcs.append(self.apply_poisson_noise)
 
-        if len(p) == 0:
+        self.noise_choice = Choice(funcs, p) if funcs else None
+
+    def apply(self, img, rng):
+        """
+        :param img: uint8 word image
+        :param rng: numpy random Generator of current image
+        :return: uint8 image
+        """
+        if self.noise_choice is None:
             return img
 
-        noise_func = np.random.choice(funcs, p=p)
+        noise_func = self.noise_choice.draw(rng)
 
-        return noise_func(img)
+        return noise_func(img, rng)
 
-    def apply_gauss_noise(self, img):
+    def apply_gauss_noise(self, img, rng):
         """
         Gaussian-distributed additive noise.
         """
         mean = 0
         stddev = np.sqrt(15)
-        gauss_noise = np.zeros(img.shape)
-        cv2.randn(gauss_noise, mean, stddev)
-        out = img + gauss_noise
+        gauss_noise = rng.normal(mean, stddev, img.shape)
+        return add_noise(img, gauss_noise)
 
-        return out
-
-    def apply_uniform_noise(self, img):
+    def apply_uniform_noise(self, img, rng):
         """
         Apply zero-mean uniform noise
         """
         imshape = img.shape
         alpha = 0.05
-        gauss = np.random.uniform(0 - alpha, alpha, imshape)
+        gauss = rng.uniform(0 - alpha, alpha, imshape)
         gauss = gauss.reshape(*imshape)
-        out = img + img * gauss
-        return out
+        return add_noise(img, img * gauss)
 
-    def apply_sp_noise(self, img):
+    def apply_sp_noise(self, img, rng):
         """
         Salt and pepper noise. Replaces random pixels with 0 or 255.
         """
         s_vs_p = 0.5
-        amount = np.random.uniform(0.004, 0.01)
+        amount = rng.uniform(0.004, 0.01)
         out = np.copy(img)
         # Salt mode
         num_salt = np.ceil(amount * img.size * s_vs_p)
-        coords = [np.random.randint(0, i - 1, int(num_salt))
+        coords = [rng.integers(0, i - 1, int(num_salt))
                   for i in img.shape]
-        out[tuple(coords)] = 255.
+        out[tuple(coords)] = 255
 
         # Pepper mode
         num_pepper = np.ceil(amount * img.size * (1. - s_vs_p))
-        coords = [np.random.randint(0, i - 1, int(num_pepper))
+        coords = [rng.integers(0, i - 1, int(num_pepper))
                   for i in img.shape]
         out[tuple(coords)] = 0
         return out
 
-    def apply_poisson_noise(self, img):
+    def apply_poisson_noise(self, img, rng):
         """
         Poisson-distributed noise generated from the data.
         """
-        vals = len(np.unique(img))
+        # Number of distinct values
+        vals = np.count_nonzero(np.bincount(img.ravel(), minlength=256))
         vals = 2 ** np.ceil(np.log2(vals))
 
         if vals < 0:
             return img
 
-        noisy = np.random.poisson(img * vals) / float(vals)
-        return noisy
+        noisy = rng.poisson(img * vals) / float(vals)
+        return to_uint8(noisy)
@@ -0,0 +1,145 @@
+"""
+Render steps as an ordered registry of named stages. A stage is a function taking the state of current
+render, it reads and updates the state (e.g. state.img, state.text_box_pnts) in place.
+Hooks are called before and after every stage, e.g. StageProfiler records time and memory of each stage.
+
+Add a custom stage without changing Renderer:
+
+    def add_stain(state):
+        state.img = my_stain(state.img, state.rng)
+
+    renderer.text_pipeline.register('stain', add_stain, after='curve')
+"""
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Pipeline(object):
+    def __init__(self):
+        # stage name -> func(state)
+        self.stages = OrderedDict()
+        self.pre_hooks = []
+        self.post_hooks = []
+
+    def register(self, name, func, before=None, after=None):
+        """
+        Add a stage at the end, or before/after an existing stage
+        """
+        if name in self.stages:
+            print("Stage [%s] already registered" % name)
+            exit(-1)
+
+        anchor = before if before is not None else after
+        if anchor is None:
+            self.stages[name] = func
+            return
+
+        if anchor not in self.stages:
+            print("Stage [%s] not found, registered stages: %s" % (anchor, ', '.join(self.stages.keys())))
+            exit(-1)
+
+        items = list(self.stages.items())
+        i = [n for n, _ in items].index(anchor)
+        if after is not None:
+            i += 1
+        items.insert(i, (name, func))
+        self.stages = OrderedDict(items)
+
+    def unregister(self, name):
+        self.stages.pop(name)
+
+    def add_hook(self, pre=None, post=None):
+        """
+        :param pre: func(stage_name, state), called before every stage
+        :param post: func(stage_name, state), called after every stage
+        """
+        if pre is not None:
+            self.pre_hooks.append(pre)
+        if post is not None:
+            self.post_hooks.append(post)
+
+    def run(self, state):
+        for name, func in self.stages.items():
+            for hook in self.pre_hooks:
+                hook(name, state)
+            func(state)
+            for hook in self.post_hooks:
+                hook(name, state)
+        return state
+
+
+class RenderState(object):
+    """
+    Values passed between stages, stages can add any attribute
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def state_nbytes(state):
+    """
+    :return: size of image (text stages) or images (output stages) in state
+    """
+    imgs = getattr(state, 'imgs', None)
+    if imgs is None:
+        imgs = [getattr(state, 'img', None)]
+    return sum([img.nbytes for img in imgs if isinstance(img, np.ndarray)])
+
+
+class StageProfiler(object):
+    """
+    Record wall time and memory of every stage, add it to pipelines by attach().
+    Memory is size of the image(s) a stage outputs. If trace_malloc is True, peak memory allocated during
+    a stage (numpy arrays, including those returned by opencv) is also traced with tracemalloc,
+    which makes rendering slower.
+    """
+
+    def __init__(self, trace_malloc=False):
+        self.trace_malloc = trace_malloc
+        # stage name -> [calls, seconds, output bytes, peak allocated bytes]
+        self.stats = OrderedDict()
+        self.start_time = 0
+        self.start_memory = 0
+
+    def attach(self, *pipelines):
+        if self.trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        for pipeline in pipelines:
+            pipeline.add_hook(pre=self.pre, post=self.post)
+
+    def pre(self, name, state):
+        if self.trace_malloc:
+            tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_time = time.perf_counter()
+
+    def post(self, name, state):
+        seconds = time.perf_counter() - self.start_time
+
+        stat = self.stats.setdefault(name, [0, 0., 0, 0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] += state_nbytes(state)
+        if self.trace_malloc:
+            stat[3] += tracemalloc.get_traced_memory()[1] - self.start_memory
+
+    def report(self):
+        """
+        Print mean time and memory of every stage, stages in the order they first run
+        """
+        header = "{:<14} {:>8} {:>10} {:>10} {:>12}".format('stage', 'calls', 'total ms', 'mean ms', 'output KB')
+        if self.trace_malloc:
+            header += " {:>12}".format('alloc KB')
+        print(header)
+
+        for name, (calls, seconds, nbytes, alloc) in self.stats.items():
+            line = "{:<14} {:>8d} {:>10.1f} {:>10.3f} {:>12.1f}".format(
+                name, calls, seconds * 1000, seconds / calls * 1000, nbytes / calls / 1024)
+            if self.trace_malloc:
+                line += " {:>12.1f}".format(alloc / calls / 1024)
+            print(line)
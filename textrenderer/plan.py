@@ -0,0 +1,68 @@
+"""
+Config compiled once into tables for drawing random decisions of an image, instead of walking the config
+and building probability lists for every image. Draws consume the random generator exactly like
+libs.utils.apply() and Generator.choice(p=...), so a seed still gives the same images.
+"""
+import bisect
+
+import numpy as np
+
+
+class Choice(object):
+    """
+    Pick one of options by probability p. Same result as options[rng.choice(len(options), p=p)],
+    without checking p and creating arrays on every draw.
+    """
+
+    def __init__(self, options, p):
+        self.options = list(options)
+
+        # Same cumulative probability as Generator.choice()
+        cdf = np.cumsum(np.asarray(p, dtype=np.float64))
+        if len(cdf) > 0:
+            cdf /= cdf[-1]
+        self.cdf = cdf.tolist()
+
+    def draw(self, rng):
+        return self.options[bisect.bisect_right(self.cdf, rng.random())]
+
+
+class ColorChoice(object):
+    """
+    Pick a color of a config section like font_color by fraction, than a random RGB value in its boundary
+    """
+
+    def __init__(self, color_cfg):
+        names = [k for k in color_cfg.keys() if k != 'enable']
+        self.choice = Choice(range(len(names)), [color_cfg[name].fraction for name in names])
+        self.l_boundaries = np.array([color_cfg[name].l_boundary for name in names], dtype=np.int64)
+        self.h_boundaries = np.array([color_cfg[name].h_boundary for name in names], dtype=np.int64)
+
+    def draw(self, rng):
+        """
+        :return: b, g, r
+        """
+        i = self.choice.draw(rng)
+        r, g, b = rng.integers(self.l_boundaries[i], self.h_boundaries[i]).tolist()
+        return b, g, r
+
+
+class EffectPlan(object):
+    """
+    enable and fraction of every top level effect in config, e.g. noise, blur, crop
+    """
+
+    def __init__(self, cfg):
+        # effect name -> fraction, None if effect is disabled
+        self.fractions = {}
+        for name, item in cfg.items():
+            if isinstance(item, dict) and 'enable' in item and 'fraction' in item:
+                assert 0 <= item.fraction <= 1
+                self.fractions[name] = item.fraction if item.enable else None
+
+    def apply(self, name, rng):
+        """
+        Same as libs.utils.apply(cfg[name], rng)
+        """
+        fraction = self.fractions[name]
+        return fraction is not None and rng.random() <= fraction
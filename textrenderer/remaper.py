@@ -1,4 +1,3 @@
-import random
 import cv2
 import numpy as np
 
@@ -7,13 +6,14 @@ class Remaper(object):
     def __init__(self, cfg):
         self.cfg = cfg
 
-    def apply(self, word_img, text_box_pnts, word_color):
+    def apply(self, word_img, text_box_pnts, word_color, rng):
         """
         :param word_img:  word image with big background
         :param text_box_pnts: left-top, right-top, right-bottom, left-bottom of text word
+        :param rng: numpy random Generator of current image
         :return:
         """
-        max_val = np.random.uniform(self.cfg.curve.min, self.cfg.curve.max)
+        max_val = rng.uniform(self.cfg.curve.min, self.cfg.curve.max)
 
         h = word_img.shape[0]
         w = word_img.shape[1]
@@ -1,24 +1,40 @@
 import math
-import random
+from collections import defaultdict
+
 import numpy as np
 import cv2
 from PIL import ImageFont, Image, ImageDraw
-from tenacity import retry
 
 import libs.math_utils as math_utils
-from libs.utils import draw_box, draw_bbox, prob, apply
+from libs.utils import draw_box, draw_bbox, prob, get_img_rng, apply_on_batch
 from libs.timer import Timer
 from textrenderer.liner import Liner
 from textrenderer.noiser import Noiser
 import libs.font_utils as font_utils
+from textrenderer.errors import FontCoverageError, EmptyCropError, WarpError
+from textrenderer.plan import EffectPlan, Choice, ColorChoice
+from textrenderer.pipeline import Pipeline, RenderState
 
 # noinspection PyMethodMayBeStatic
 from textrenderer.remaper import Remaper
 
+# Empty pixels around text in text layer mode, leave space for text border and glyph overhang
+TEXT_LAYER_PADDING = 4
+
+
+def is_bgr_cfg(cfg):
+    """
+    Output images are BGR if text or line color is enabled, otherwise gray
+    """
+    return cfg.font_color.enable or cfg.line_color.enable
+
 
 class Renderer(object):
     def __init__(self, corpus, fonts, bgs, cfg, width=256, height=32,
-                 clip_max_chars=False, debug=False, gpu=False, strict=False):
+                 clip_max_chars=False, debug=False, gpu=False, strict=False, seed=0, text_layer=False):
+        """
+        :param bgs: BackgroundStore, backgrounds already converted to gray if output image is gray
+        """
         self.corpus = corpus
         self.fonts = fonts
         self.bgs = bgs
@@ -29,8 +45,18 @@ class Renderer(object):
         self.debug = debug
         self.gpu = gpu
         self.strict = strict
+        self.seed = seed
+        self.text_layer = text_layer
         self.cfg = cfg
 
+        # Config compiled for drawing random decisions of every image
+        self.plan = EffectPlan(cfg)
+        self.word_color_choice = ColorChoice(cfg.font_color)
+        # 0: border lighter than text, 1: darker
+        self.border_choice = Choice(
+            [i for i, item in enumerate([cfg.text_border.light, cfg.text_border.dark]) if item.enable],
+            [item.fraction for item in [cfg.text_border.light, cfg.text_border.dark] if item.enable])
+
         self.timer = Timer()
         self.liner = Liner(cfg)
         self.noiser = Noiser(cfg)
@@ -38,94 +64,352 @@ class Renderer(object):
 
         self.create_kernals()
 
-        if not self.is_bgr():
-            for i, bg in enumerate(self.bgs):
-                self.bgs[i] = cv2.cvtColor(bg, cv2.COLOR_BGR2GRAY)
+        # Ordered render stages, custom stages and hooks can be added to them
+        if self.text_layer:
+            self.text_pipeline = self.build_text_layer_pipeline()
+        else:
+            self.text_pipeline = self.build_canvas_pipeline()
+        self.output_pipeline = self.build_output_pipeline()
+        if self.debug:
+            for pipeline in [self.text_pipeline, self.output_pipeline]:
+                pipeline.add_hook(post=lambda name, state: self.dmsg("After %s" % name))
 
         if self.strict:
             self.font_unsupport_chars = font_utils.get_unsupported_chars(self.fonts, corpus.chars_file)
 
-    def gen_img(self, img_index):
-        word, font, word_size = self.pick_font(img_index)
+        if self.text_layer:
+            canvas_effects = [name for name in ['line', 'curve', 'seamless_clone'] if self.cfg[name].enable]
+            if canvas_effects:
+                print('Text layer mode does not support %s, they are applied on the whole background' %
+                      ', '.join(canvas_effects))
+                exit(-1)
+            if self.debug:
+                print('Text layer mode does not support debug')
+                exit(-1)
+
+    def get_rng(self, img_index):
+        return get_img_rng(self.seed, img_index)
+
+    def gen_img(self, img_index, rng=None):
+        """
+        :param img_index: index of image, used by list corpus
+        :param rng: numpy random Generator, all random decisions of this image are drawn from it.
+                    If None, use a generator derived from (seed, img_index), so same image can be
+                    regenerated at any time.
+        """
+        if rng is None:
+            rng = self.get_rng(img_index)
+
+        word_img, word = self.gen_text_img(img_index, rng)
+        return self.apply_output_effects([word_img], [rng])[0], word
+
+    def gen_batch(self, indices, rngs=None):
+        """
+        Render images of indices, same images as calling gen_img() one by one. Text images are rendered
+        one by one, output effects are applied on the whole batch.
+        :param rngs: numpy random Generator of each image, default is derived from (seed, img_index)
+        :return:
+            imgs: uint8 array (N, H, W[, C]) if all images have same shape (img_width > 0), otherwise list
+            words: list of text on images
+        """
+        if rngs is None:
+            rngs = [self.get_rng(img_index) for img_index in indices]
+
+        word_imgs = []
+        words = []
+        for img_index, rng in zip(indices, rngs):
+            word_img, word = self.gen_text_img(img_index, rng)
+            word_imgs.append(word_img)
+            words.append(word)
+
+        return self.apply_output_effects(word_imgs, rngs), words
+
+    def gen_text_img(self, img_index, rng):
+        """
+        Pick text and font, draw text and transform it to output size by text_pipeline.
+        Output effects are not applied.
+        :return: uint8 image, word
+        """
+        word, font, word_size = self.pick_font(img_index, rng)
         self.dmsg("after pick font")
 
+        state = self.text_pipeline.run(RenderState(word=word, font=font, word_size=word_size, rng=rng))
+        return state.img, word
+
+    def apply_output_effects(self, imgs, rngs):
+        """
+        Apply noise, blur, prydown, reverse_color, emboss and sharp on a batch of images by output_pipeline.
+        Random decisions of an image are drawn from its own rng in same order as a single image, so result
+        doesn't depend on other images in the batch. Images applied with same filter are processed by one
+        opencv call.
+        :param imgs: list of uint8 images
+        :param rngs: numpy random Generator of each image
+        :return: uint8 array (N, H, W[, C]) if all images have same shape, otherwise list
+        """
+        if len(set([img.shape for img in imgs])) == 1:
+            imgs = np.stack(imgs)
+        else:
+            imgs = list(imgs)
+
+        return self.output_pipeline.run(RenderState(imgs=imgs, rngs=rngs)).imgs
+
+    def build_canvas_pipeline(self):
+        """
+        Draw text on a large background, apply effects and perspective transform on the whole background,
+        then crop text from it. Output image has desired output size, or is the whole transformed image
+        in debug mode.
+        """
+        pipeline = Pipeline()
+        pipeline.register('draw', self.canvas_draw_stage)
+        pipeline.register('crop', self.crop_stage)
+        pipeline.register('line', self.line_stage)
+        pipeline.register('curve', self.curve_stage)
+        pipeline.register('perspective', self.perspective_stage)
+        pipeline.register('crop_resize', self.canvas_crop_resize_stage)
+        return pipeline
+
+    def build_text_layer_pipeline(self):
+        """
+        Draw text alone on a tight mask, warp the mask directly to output size and blend text color
+        onto a background generated at output size. Only the small text mask is transformed,
+        background keeps its texture without perspective.
+        """
+        pipeline = Pipeline()
+        pipeline.register('draw', self.text_layer_draw_stage)
+        pipeline.register('crop', self.crop_stage)
+        pipeline.register('perspective', self.perspective_stage)
+        pipeline.register('crop_resize', self.text_layer_crop_resize_stage)
+        return pipeline
+
+    def build_output_pipeline(self):
+        pipeline = Pipeline()
+        pipeline.register('noise', self.noise_stage)
+        pipeline.register('blur', self.blur_stage)
+        pipeline.register('prydown', self.prydown_stage)
+        pipeline.register('reverse', self.reverse_stage)
+        pipeline.register('emboss', self.emboss_stage)
+        pipeline.register('sharp', self.sharp_stage)
+        return pipeline
+
+    def canvas_draw_stage(self, state):
         # Background's height should much larger than raw word image's height,
         # to make sure we can crop full word image after apply perspective
-        bg = self.gen_bg(width=word_size[0] * 8, height=word_size[1] * 8)
-        word_img, text_box_pnts, word_color = self.draw_text_on_bg(word, font, bg)
-        self.dmsg("After draw_text_on_bg")
+        bg = self.gen_bg(state.word_size[0] * 8, state.word_size[1] * 8, state.rng)
+        state.img, state.text_box_pnts, state.word_color = self.draw_text_on_bg(state.word, state.font, bg,
+                                                                                state.rng)
 
-        if apply(self.cfg.crop):
-            text_box_pnts = self.apply_crop(text_box_pnts, self.cfg.crop)
+    def text_layer_draw_stage(self, state):
+        # img is the text mask
+        state.img, state.border_mask, state.text_box_pnts = self.draw_text_layer(state.word, state.font,
+                                                                                 state.word_size, state.rng)
 
-        if apply(self.cfg.line):
-            word_img, text_box_pnts = self.liner.apply(word_img, text_box_pnts, word_color)
-            self.dmsg("After draw line")
+    def crop_stage(self, state):
+        if self.plan.apply('crop', state.rng):
+            state.text_box_pnts = self.apply_crop(state.text_box_pnts, self.cfg.crop, state.rng)
+
+    def line_stage(self, state):
+        if self.plan.apply('line', state.rng):
+            state.img, state.text_box_pnts = self.liner.apply(state.img, state.text_box_pnts, state.word_color,
+                                                              state.rng)
 
         if self.debug:
-            word_img = draw_box(word_img, text_box_pnts, (0, 255, 155))
+            state.img = draw_box(state.img, state.text_box_pnts, (0, 255, 155))
 
-        if apply(self.cfg.curve):
-            word_img, text_box_pnts = self.remaper.apply(word_img, text_box_pnts, word_color)
-            self.dmsg("After remapping")
+    def curve_stage(self, state):
+        if self.plan.apply('curve', state.rng):
+            state.img, state.text_box_pnts = self.remaper.apply(state.img, state.text_box_pnts, state.word_color,
+                                                                state.rng)
 
         if self.debug:
-            word_img = draw_box(word_img, text_box_pnts, (155, 255, 0))
+            state.img = draw_box(state.img, state.text_box_pnts, (155, 255, 0))
 
-        word_img, img_pnts_transformed, text_box_pnts_transformed = \
-            self.apply_perspective_transform(word_img, text_box_pnts,
-                                             max_x=self.cfg.perspective_transform.max_x,
-                                             max_y=self.cfg.perspective_transform.max_y,
-                                             max_z=self.cfg.perspective_transform.max_z,
-                                             gpu=self.gpu)
+    def perspective_stage(self, state):
+        """
+        Random perspective matrix. Image is warped with crop and resize in one transform by crop_resize
+        stage, except in debug mode, the whole transformed image is kept to show text box and crop box on it.
+        """
+        max_x = self.cfg.perspective_transform.max_x
+        max_y = self.cfg.perspective_transform.max_y
+        max_z = self.cfg.perspective_transform.max_z
 
-        self.dmsg("After perspective transform")
+        if self.debug:
+            state.img, _, state.text_box_pnts = self.apply_perspective_transform(
+                state.img, state.text_box_pnts, max_x, max_y, max_z, state.rng, gpu=self.gpu)
+        else:
+            state.M33, state.sl, state.text_box_pnts, state.angles = self.get_perspective_matrix(
+                state.img, state.text_box_pnts, max_x, max_y, max_z, state.rng)
 
+    def canvas_crop_resize_stage(self, state):
         if self.debug:
-            _, crop_bbox = self.crop_img(word_img, text_box_pnts_transformed)
-            word_img = draw_bbox(word_img, crop_bbox, (255, 0, 0))
+            _, crop_bbox = self.crop_img(state.img, state.text_box_pnts, state.rng)
+            state.img = draw_bbox(state.img, crop_bbox, (255, 0, 0))
         else:
-            word_img, crop_bbox = self.crop_img(word_img, text_box_pnts_transformed)
+            state.img, _ = self.apply_warp_crop(state.img, state.M33, state.sl, state.text_box_pnts, state.angles,
+                                                state.rng, gpu=self.gpu)
 
-        self.dmsg("After crop_img")
+    def text_layer_crop_resize_stage(self, state):
+        text_mask = state.img
+        rng = state.rng
 
-        if apply(self.cfg.noise):
-            word_img = np.clip(word_img, 0., 255.)
-            word_img = self.noiser.apply(word_img)
-            self.dmsg("After noiser")
+        # Text mask is transparent out of its border, so crop box is not cut off like apply_warp_crop()
+        crop_bbox, dst_size = self.get_crop_bbox(state.text_box_pnts, rng)
+        M33 = np.matmul(self.get_crop_matrix(crop_bbox[0], crop_bbox[1],
+                                             crop_bbox[0] + crop_bbox[2], crop_bbox[1] + crop_bbox[3],
+                                             dst_size), state.M33)
 
-        blured = False
-        if apply(self.cfg.blur):
-            blured = True
-            word_img = self.apply_blur_on_output(word_img)
-            self.dmsg("After blur")
+        bg = self.gen_bg(dst_size[0], dst_size[1], rng)
+
+        if self.is_bgr():
+            word_color = self.get_word_color(rng)
+        else:
+            # Like get_gray_word_color(), output background is the area around text
+            word_color = int(rng.integers(0, int(np.mean(bg) * (2 / 3)) + 1))
+
+        try:
+            if state.border_mask is not None:
+                border_color = self.get_border_color(word_color, rng)
+                border_alpha = math_utils.warpPerspective(state.border_mask, M33, dst_size, self.gpu)
+                bg = self.blend_text_layer(bg, border_alpha, border_color)
+
+            text_alpha = math_utils.warpPerspective(text_mask, M33, dst_size, self.gpu)
+        except cv2.error as e:
+            raise WarpError('Perspective transform failed: %s' % e, angles=state.angles, img_shape=text_mask.shape)
+
+        state.img = self.blend_text_layer(bg, text_alpha, word_color)
+
+    def noise_stage(self, state):
+        imgs = state.imgs
+        for i, rng in enumerate(state.rngs):
+            if self.plan.apply('noise', rng):
+                imgs[i] = self.noiser.apply(imgs[i], rng)
+
+    def blur_stage(self, state):
+        imgs = state.imgs
+
+        # blur -> indexes of images
+        blurs = defaultdict(list)
+        state.blured = set()
+        for i, rng in enumerate(state.rngs):
+            if self.plan.apply('blur', rng):
+                blurs[self.get_output_blur(rng)].append(i)
+                state.blured.add(i)
+
+        for blur, indexes in blurs.items():
+            self.apply_on_indexes(imgs, indexes, lambda batch: apply_on_batch(
+                lambda img: self.apply_output_blur(img, blur), batch))
+
+    def prydown_stage(self, state):
+        # prydown is not applied on blured image
+        imgs = state.imgs
+        blured = getattr(state, 'blured', set())
+        for i, rng in enumerate(state.rngs):
+            if i not in blured and self.plan.apply('prydown', rng):
+                imgs[i] = self.apply_prydown(imgs[i], rng)
+
+    def reverse_stage(self, state):
+        # image index -> offset of reversed color
+        reverse_offsets = {}
+        for i, rng in enumerate(state.rngs):
+            if self.plan.apply('reverse_color', rng):
+                reverse_offsets[i] = int(rng.integers(-10, 10))
+        if reverse_offsets:
+            self.reverse_imgs(state.imgs, reverse_offsets)
+
+    def emboss_stage(self, state):
+        emboss_indexes = [i for i, rng in enumerate(state.rngs) if self.plan.apply('emboss', rng)]
+        self.apply_on_indexes(state.imgs, emboss_indexes, lambda batch: apply_on_batch(self.apply_emboss, batch))
+
+    def sharp_stage(self, state):
+        sharp_indexes = [i for i, rng in enumerate(state.rngs) if self.plan.apply('sharp', rng)]
+        self.apply_on_indexes(state.imgs, sharp_indexes, lambda batch: apply_on_batch(self.apply_sharp, batch))
+
+    def apply_on_indexes(self, imgs, indexes, func):
+        """
+        imgs[indexes] = func(imgs[indexes]), func takes a stacked batch of images.
+        If imgs is a list of images with different shape, func is called on every image as a batch of one.
+        """
+        if len(indexes) == 0:
+            return
+
+        if isinstance(imgs, np.ndarray):
+            imgs[indexes] = func(imgs[indexes])
+        else:
+            for i in indexes:
+                imgs[i] = func(imgs[i][np.newaxis])[0]
+
+    def draw_text_layer(self, word, font, word_size, rng):
+        """
+        Draw text with value 255 on black masks, with TEXT_LAYER_PADDING around text
+        :return:
+            text_mask: uint8 mask of text
+            border_mask: uint8 mask of text border, None if text border is not applied
+            text_box_pnts: left-top, right-top, right-bottom, left-bottom
+        """
+        layer_width, layer_height = word_size
+        if self.cfg.random_space.enable:
+            # Chars drawn one by one with random space can be larger than word size
+            chars_size = [font.getsize(c) for c in word]
+            char_height = max([size[1] for size in chars_size])
+            max_space = max(abs(self.cfg.random_space.min), abs(self.cfg.random_space.max))
+            layer_width = max(layer_width,
+                              sum([size[0] for size in chars_size]) + math.ceil(char_height * max_space) * len(word))
+            layer_height = max(layer_height, char_height)
+
+        layer_width += TEXT_LAYER_PADDING * 2
+        layer_height += TEXT_LAYER_PADDING * 2
+
+        text_layer = Image.new('L', (layer_width, layer_height), 0)
+        draw = ImageDraw.Draw(text_layer)
+        border_mask = None
+
+        if self.plan.apply('random_space', rng):
+            text_x, text_y, word_width, word_height = self.draw_text_with_random_space(draw, font, word, 255,
+                                                                                       layer_width, layer_height, rng)
+        else:
+            word_width, word_height = word_size
+            text_x = int((layer_width - word_width) / 2)
+            text_y = int((layer_height - word_height) / 2)
 
-        if not blured:
-            if apply(self.cfg.prydown):
-                word_img = self.apply_prydown(word_img)
-                self.dmsg("After prydown")
+            offset = font.getoffset(word)
+            x = text_x - offset[0]
+            y = text_y - offset[1]
 
-        word_img = np.clip(word_img, 0., 255.)
+            if self.plan.apply('text_border', rng):
+                border_layer = Image.new('L', (layer_width, layer_height), 0)
+                self.draw_border(ImageDraw.Draw(border_layer), word, x, y, font, 255)
+                border_mask = np.array(border_layer)
 
-        if apply(self.cfg.reverse_color):
-            word_img = self.reverse_img(word_img)
-            self.dmsg("After reverse_img")
+            draw.text((x, y), word, fill=255, font=font)
 
-        if apply(self.cfg.emboss):
-            word_img = self.apply_emboss(word_img)
-            self.dmsg("After emboss")
+        text_box_pnts = [
+            [text_x, text_y],
+            [text_x + word_width, text_y],
+            [text_x + word_width, text_y + word_height],
+            [text_x, text_y + word_height]
+        ]
 
-        if apply(self.cfg.sharp):
-            word_img = self.apply_sharp(word_img)
-            self.dmsg("After sharp")
+        return np.array(text_layer), border_mask, text_box_pnts
 
-        return word_img, word
+    def blend_text_layer(self, bg, alpha, color):
+        """
+        Integer alpha blending: (bg * (255 - alpha) + color * alpha) / 255, max value fits in uint16
+        :param bg: uint8 background
+        :param alpha: uint8 mask, 255 is color
+        """
+        alpha = alpha.astype(np.uint16)
+        if bg.ndim == 3:
+            alpha = alpha[:, :, np.newaxis]
+            color = np.array(color, dtype=np.uint16)
+        out = bg * (255 - alpha) + alpha * color
+        out += 127
+        out //= 255
+        return out.astype(np.uint8)
 
     def dmsg(self, msg):
         if self.debug:
             print(msg)
 
-    def random_xy_offset(self, src_height, src_width, dst_height, dst_width):
+    def random_xy_offset(self, src_height, src_width, dst_height, dst_width, rng):
         """
         Get random left-top point for putting a small rect in a large rect.
         Normally dst_height>src_height and dst_width>src_width
@@ -140,15 +424,15 @@ class Renderer(object):
 
         y_offset = 0
         if y_max_offset != 0:
-            y_offset = random.randint(0, y_max_offset)
+            y_offset = int(rng.integers(0, y_max_offset + 1))
 
         x_offset = 0
         if x_max_offset != 0:
-            x_offset = random.randint(0, x_max_offset)
+            x_offset = int(rng.integers(0, x_max_offset + 1))
 
         return x_offset, y_offset
 
-    def crop_img(self, img, text_box_pnts_transformed):
+    def crop_img(self, img, text_box_pnts_transformed, rng):
         """
         Crop text from large input image
         :param img: image to crop
@@ -157,9 +441,30 @@ class Renderer(object):
             dst: image with desired output size, height=32, width=flags.img_width
             crop_bbox: bounding box on input image
         """
+        dst_bbox, dst_size = self.get_crop_bbox(text_box_pnts_transformed, rng)
+
+        # It's important do crop first and than do resize for speed consider
+        dst = img[dst_bbox[1]:dst_bbox[1] + dst_bbox[3], dst_bbox[0]:dst_bbox[0] + dst_bbox[2]]
+        if dst.size == 0:
+            raise EmptyCropError('Crop box %s is out of image %s' % (dst_bbox, img.shape), bbox=dst_bbox,
+                                 img_shape=img.shape)
+
+        dst = cv2.resize(dst, dst_size, interpolation=cv2.INTER_CUBIC)
+
+        return dst, dst_bbox
+
+    def get_crop_bbox(self, text_box_pnts_transformed, rng):
+        """
+        Random crop box around transformed text box, with the aspect ratio of output image
+        :return:
+            crop_bbox: (x, y, width, height) on transformed image
+            dst_size: (width, height) of output image
+        """
         bbox = cv2.boundingRect(text_box_pnts_transformed)
         bbox_width = bbox[2]
         bbox_height = bbox[3]
+        if bbox_width <= 0 or bbox_height <= 0:
+            raise EmptyCropError('Text box is empty after transform: %s' % (bbox,), bbox=bbox)
 
         # Output shape is (self.out_width, self.out_height)
         # We randomly put bounding box of transformed text in the output shape
@@ -169,7 +474,7 @@ class Renderer(object):
         # we should do something to prevent text too small
 
         # dst_height and dst_width is used to leave some padding around text bbox
-        dst_height = random.randint(self.out_height // 4 * 3, self.out_height)
+        dst_height = int(rng.integers(self.out_height // 4 * 3, self.out_height + 1))
 
         if self.out_width == 0:
             scale = bbox_height / dst_height
@@ -181,7 +486,7 @@ class Renderer(object):
         s_bbox_height = math.ceil(bbox_height / scale)
 
         if self.out_width == 0:
-            padding = random.randint(s_bbox_width // 10, s_bbox_width // 8)
+            padding = int(rng.integers(s_bbox_width // 10, s_bbox_width // 8 + 1))
             dst_width = s_bbox_width + padding * 2
 
         s_bbox = (np.around(bbox[0] / scale),
@@ -189,7 +494,7 @@ class Renderer(object):
                   np.around(bbox[2] / scale),
                   np.around(bbox[3] / scale))
 
-        x_offset, y_offset = self.random_xy_offset(s_bbox_height, s_bbox_width, self.out_height, dst_width)
+        x_offset, y_offset = self.random_xy_offset(s_bbox_height, s_bbox_width, self.out_height, dst_width, rng)
 
         dst_bbox = (
             self.int_around((s_bbox[0] - x_offset) * scale),
@@ -198,17 +503,12 @@ class Renderer(object):
             self.int_around(self.out_height * scale)
         )
 
-        # It's important do crop first and than do resize for speed consider
-        dst = img[dst_bbox[1]:dst_bbox[1] + dst_bbox[3], dst_bbox[0]:dst_bbox[0] + dst_bbox[2]]
-
-        dst = cv2.resize(dst, (dst_width, self.out_height), interpolation=cv2.INTER_CUBIC)
-
-        return dst, dst_bbox
+        return dst_bbox, (dst_width, self.out_height)
 
     def int_around(self, val):
         return int(np.around(val))
 
-    def get_gray_word_color(self, bg, text_x, text_y, word_height, word_width):
+    def get_gray_word_color(self, bg, text_x, text_y, word_height, word_width, rng):
         """
         Only use word roi area to get word color
         """
@@ -221,34 +521,20 @@ class Renderer(object):
         word_roi_bg = bg[ymin: ymax, xmin: xmax]
 
         bg_mean = int(np.mean(word_roi_bg) * (2 / 3))
-        word_color = random.randint(0, bg_mean)
+        word_color = int(rng.integers(0, bg_mean + 1))
         return word_color
 
-    def get_word_color(self):
-        p = []
-        colors = []
-        for k, v in self.cfg.font_color.items():
-            if k == 'enable':
-                continue
-            p.append(v.fraction)
-            colors.append(k)
-
-        # pick color by fraction
-        color_name = np.random.choice(colors, p=p)
-        l_boundary = self.cfg.font_color[color_name].l_boundary
-        h_boundary = self.cfg.font_color[color_name].h_boundary
-        # random color by low and high RGB boundary
-        r = np.random.randint(l_boundary[0], h_boundary[0])
-        g = np.random.randint(l_boundary[1], h_boundary[1])
-        b = np.random.randint(l_boundary[2], h_boundary[2])
-        return b, g, r
-
-    def draw_text_on_bg(self, word, font, bg):
+    def get_word_color(self, rng):
+        # pick color by fraction, random color by low and high RGB boundary
+        return self.word_color_choice.draw(rng)
+
+    def draw_text_on_bg(self, word, font, bg, rng):
         """
         Draw word in the center of background
         :param word: word to draw
         :param font: font to draw word
         :param bg: background numpy image
+        :param rng: numpy random Generator
         :return:
             np_img: word image
             text_box_pnts: left-top, right-top, right-bottom, left-bottom
@@ -270,22 +556,22 @@ class Renderer(object):
         text_y = int((bg_height - word_height) / 2)
 
         if self.is_bgr():
-            word_color = self.get_word_color()
+            word_color = self.get_word_color(rng)
         else:
-            word_color = self.get_gray_word_color(bg, text_x, text_y, word_height, word_width)
+            word_color = self.get_gray_word_color(bg, text_x, text_y, word_height, word_width, rng)
 
-        if apply(self.cfg.random_space):
+        if self.plan.apply('random_space', rng):
             text_x, text_y, word_width, word_height = self.draw_text_with_random_space(draw, font, word, word_color,
-                                                                                       bg_width, bg_height)
-            np_img = np.array(pil_img).astype(np.float32)
+                                                                                       bg_width, bg_height, rng)
+            np_img = np.array(pil_img)
         else:
-            if apply(self.cfg.seamless_clone):
-                np_img = self.draw_text_seamless(font, bg, word, word_color, word_height, word_width, offset)
+            if self.plan.apply('seamless_clone', rng):
+                np_img = self.draw_text_seamless(font, bg, word, word_color, word_height, word_width, offset, rng)
             else:
-                self.draw_text_wrapper(draw, word, text_x - offset[0], text_y - offset[1], font, word_color)
+                self.draw_text_wrapper(draw, word, text_x - offset[0], text_y - offset[1], font, word_color, rng)
                 # draw.text((text_x - offset[0], text_y - offset[1]), word, fill=word_color, font=font)
 
-                np_img = np.array(pil_img).astype(np.float32)
+                np_img = np.array(pil_img)
 
         text_box_pnts = [
             [text_x, text_y],
@@ -296,7 +582,7 @@ class Renderer(object):
 
         return np_img, text_box_pnts, word_color
 
-    def draw_text_seamless(self, font, bg, word, word_color, word_height, word_width, offset):
+    def draw_text_seamless(self, font, bg, word, word_color, word_height, word_width, offset, rng):
         # For better seamlessClone
         seamless_offset = 6
 
@@ -315,7 +601,7 @@ class Renderer(object):
         self.draw_text_wrapper(draw, word,
                                0 + seamless_offset // 2,
                                0 - offset[1] + seamless_offset // 2,
-                               font, word_color)
+                               font, word_color, rng)
 
         # assume whole text_img as mask
         text_img = np.array(text_img).astype(np.uint8)
@@ -334,11 +620,11 @@ class Renderer(object):
             text_img_bgr = text_img
             bg_bgr = bg
 
-        flag = np.random.choice([
+        flag = int(rng.choice([
             cv2.NORMAL_CLONE,
             cv2.MIXED_CLONE,
             cv2.MONOCHROME_TRANSFER
-        ])
+        ]))
 
         mixed_clone = cv2.seamlessClone(text_img_bgr, bg_bgr, text_mask, center, flag)
 
@@ -347,7 +633,7 @@ class Renderer(object):
         else:
             return mixed_clone
 
-    def draw_text_with_random_space(self, draw, font, word, word_color, bg_width, bg_height):
+    def draw_text_with_random_space(self, draw, font, word, word_color, bg_width, bg_height, rng):
         """ If random_space applied, text_x, text_y, word_width, word_height may change"""
         width = 0
         height = 0
@@ -368,7 +654,7 @@ class Renderer(object):
             if c_offset[1] < y_offset:
                 y_offset = c_offset[1]
 
-        char_space_width = int(height * np.random.uniform(self.cfg.random_space.min, self.cfg.random_space.max))
+        char_space_width = int(height * rng.uniform(self.cfg.random_space.min, self.cfg.random_space.max))
 
         width += (char_space_width * (len(word) - 1))
 
@@ -386,51 +672,55 @@ class Renderer(object):
 
         return text_x, text_y, width, height
 
-    def draw_text_wrapper(self, draw, text, x, y, font, text_color):
+    def draw_text_wrapper(self, draw, text, x, y, font, text_color, rng):
         """
         :param x/y: 应该是移除了 offset 的
         """
-        if apply(self.cfg.text_border):
-            self.draw_border_text(draw, text, x, y, font, text_color)
+        if self.plan.apply('text_border', rng):
+            self.draw_border_text(draw, text, x, y, font, text_color, rng)
         else:
             draw.text((x, y), text, fill=text_color, font=font)
 
-    def draw_border_text(self, draw, text, x, y, font, text_color):
+    def draw_border_text(self, draw, text, x, y, font, text_color, rng):
         """
         :param x/y: 应该是移除了 offset 的
         """
-        # thickness larger than 1 may give bad border result
-        thickness = 1
+        border_color = self.get_border_color(text_color, rng)
+        self.draw_border(draw, text, x, y, font, border_color)
 
-        choices = []
-        p = []
-        if self.cfg.text_border.light.enable:
-            choices.append(0)
-            p.append(self.cfg.text_border.light.fraction)
-        if self.cfg.text_border.dark.enable:
-            choices.append(1)
-            p.append(self.cfg.text_border.dark.fraction)
+        # now draw the text over it
+        draw.text((x, y), text, font=font, fill=text_color)
 
-        light_or_dark = np.random.choice(choices, p=p)
+    def get_border_color(self, text_color, rng):
+        """
+        Random border color lighter or darker than text color
+        """
+        light_or_dark = self.border_choice.draw(rng)
 
         if light_or_dark == 0:
             if self.is_bgr():
                 border_color = (
-                    text_color[0] + np.random.randint(0, 255 - text_color[0] - 1),
-                    text_color[1] + np.random.randint(0, 255 - text_color[1] - 1),
-                    text_color[2] + np.random.randint(0, 255 - text_color[2] - 1)
+                    text_color[0] + int(rng.integers(0, 255 - text_color[0] - 1)),
+                    text_color[1] + int(rng.integers(0, 255 - text_color[1] - 1)),
+                    text_color[2] + int(rng.integers(0, 255 - text_color[2] - 1))
                 )
             else:
-                border_color = text_color + np.random.randint(0, 255 - text_color - 1)
+                border_color = text_color + int(rng.integers(0, 255 - text_color - 1))
         elif light_or_dark == 1:
             if self.is_bgr():
                 border_color = (
-                    text_color[0] - np.random.randint(0, text_color[0] + 1),
-                    text_color[1] - np.random.randint(0, text_color[1] + 1),
-                    text_color[2] - np.random.randint(0, text_color[2] + 1)
+                    text_color[0] - int(rng.integers(0, text_color[0] + 1)),
+                    text_color[1] - int(rng.integers(0, text_color[1] + 1)),
+                    text_color[2] - int(rng.integers(0, text_color[2] + 1))
                 )
             else:
-                border_color = text_color - np.random.randint(0, text_color + 1)
+                border_color = text_color - int(rng.integers(0, text_color + 1))
+
+        return border_color
+
+    def draw_border(self, draw, text, x, y, font, border_color):
+        # thickness larger than 1 may give bad border result
+        thickness = 1
 
         # thin border
         draw.text((x - thickness, y), text, font=font, fill=border_color)
@@ -444,45 +734,42 @@ class Renderer(object):
         draw.text((x - thickness, y + thickness), text, font=font, fill=border_color)
         draw.text((x + thickness, y + thickness), text, font=font, fill=border_color)
 
-        # now draw the text over it
-        draw.text((x, y), text, font=font, fill=text_color)
-
-    def gen_bg(self, width, height):
-        if apply(self.cfg.img_bg):
-            bg = self.gen_bg_from_image(int(width), int(height))
+    def gen_bg(self, width, height, rng):
+        if self.plan.apply('img_bg', rng):
+            bg = self.gen_bg_from_image(int(width), int(height), rng)
         else:
-            bg = self.gen_rand_bg(int(width), int(height))
+            bg = self.gen_rand_bg(int(width), int(height), rng)
         return bg
 
-    def gen_rand_bg(self, width, height):
+    def gen_rand_bg(self, width, height, rng):
         """
         Generate random background
         """
-        bg_high = random.uniform(220, 255)
-        bg_low = bg_high - random.uniform(1, 60)
+        bg_high = rng.uniform(220, 255)
+        bg_low = bg_high - rng.uniform(1, 60)
 
-        bg = np.random.randint(bg_low, bg_high, (height, width)).astype(np.uint8)
+        bg = rng.integers(int(bg_low), int(bg_high), (height, width), dtype=np.uint8)
 
-        bg = self.apply_gauss_blur(bg)
+        bg = self.apply_gauss_blur(bg, rng)
 
         if self.is_bgr():
             bg = cv2.cvtColor(bg, cv2.COLOR_GRAY2BGR)
 
         return bg
 
-    def gen_bg_from_image(self, width, height):
+    def gen_bg_from_image(self, width, height, rng):
         """
         Resize background, let bg_width>=width, bg_height >=height, and random crop from resized background
         """
         assert width > height
 
-        bg = random.choice(self.bgs)
+        bg = self.bgs[rng.integers(len(self.bgs))]
 
         scale = max(width / bg.shape[1], height / bg.shape[0])
 
         out = cv2.resize(bg, None, fx=scale, fy=scale)
 
-        x_offset, y_offset = self.random_xy_offset(height, width, out.shape[0], out.shape[1])
+        x_offset, y_offset = self.random_xy_offset(height, width, out.shape[0], out.shape[1], rng)
 
         out = out[y_offset:y_offset + height, x_offset:x_offset + width]
 
@@ -497,20 +784,20 @@ class Renderer(object):
 
         return out
 
-    @retry
-    def pick_font(self, img_index):
+    def pick_font(self, img_index, rng):
         """
         :param img_index when use list corpus, this param is used
+        :param rng: numpy random Generator, it has moved forward when image is retried so another word/font is picked
         :return:
             font: truetype
             size: word size, removed offset (width, height)
         """
-        word = self.corpus.get_sample(img_index)
+        word = self.corpus.get_sample(img_index, rng)
 
         if self.clip_max_chars and len(word) > self.max_chars:
             word = word[:self.max_chars]
 
-        font_path = random.choice(self.fonts)
+        font_path = self.fonts[rng.integers(len(self.fonts))]
 
         if self.strict:
             unsupport_chars = self.font_unsupport_chars[font_path]
@@ -518,15 +805,19 @@ class Renderer(object):
                 if c == ' ':
                     continue
                 if c in unsupport_chars:
-                    print('Retry pick_font(), \'%s\' contains chars \'%s\' not supported by font %s' % (
-                        word, c, font_path))
-                    raise Exception
+                    raise FontCoverageError('\'%s\' contains chars \'%s\' not supported by font %s' % (
+                        word, c, font_path), word=word, font=font_path, char=c)
 
         # Font size in point
-        font_size = random.randint(self.cfg.font_size.min, self.cfg.font_size.max)
+        font_size = int(rng.integers(self.cfg.font_size.min, self.cfg.font_size.max + 1))
         font = ImageFont.truetype(font_path, font_size)
 
-        return word, font, self.get_word_size(font, word)
+        word_size = self.get_word_size(font, word)
+        if word_size[0] <= 0 or word_size[1] <= 0:
+            raise EmptyCropError('Text \'%s\' has empty size %s with font %s' % (word, word_size, font_path),
+                                 word=word, font=font_path, font_size=font_size)
+
+        return word, font, word_size
 
     def get_word_size(self, font, word):
         """
@@ -541,7 +832,7 @@ class Renderer(object):
         size = (size[0] - offset[0], size[1] - offset[1])
         return size
 
-    def apply_perspective_transform(self, img, text_box_pnts, max_x, max_y, max_z, gpu=False):
+    def apply_perspective_transform(self, img, text_box_pnts, max_x, max_y, max_z, rng, gpu=False):
         """
         Apply perspective transform on image
         :param img: origin numpy image
@@ -555,59 +846,167 @@ class Renderer(object):
             dst_text_pnts: points of text after apply perspective transform
         """
 
-        x = math_utils.cliped_rand_norm(0, max_x)
-        y = math_utils.cliped_rand_norm(0, max_y)
-        z = math_utils.cliped_rand_norm(0, max_z)
-
-        # print("x: %f, y: %f, z: %f" % (x, y, z))
+        transformer = self.get_perspective_transformer(max_x, max_y, max_z, rng)
+        angles = (transformer.x, transformer.y, transformer.z)
 
-        transformer = math_utils.PerspectiveTransform(x, y, z, scale=1.0, fovy=50)
+        try:
+            dst_img, M33, dst_img_pnts = transformer.transform_image(img, gpu)
+            dst_text_pnts = transformer.transform_pnts(text_box_pnts, M33)
+        except cv2.error as e:
+            raise WarpError('Perspective transform failed: %s' % e, angles=angles, img_shape=img.shape)
 
-        dst_img, M33, dst_img_pnts = transformer.transform_image(img, gpu)
-        dst_text_pnts = transformer.transform_pnts(text_box_pnts, M33)
+        if not np.isfinite(dst_text_pnts).all():
+            raise WarpError('Text box is invalid after perspective transform', angles=angles, img_shape=img.shape)
 
         return dst_img, dst_img_pnts, dst_text_pnts
 
-    def apply_blur_on_output(self, img):
-        if prob(0.5):
-            return self.apply_gauss_blur(img, [3, 5])
+    def apply_warp_crop(self, img, M33, sl, dst_text_pnts, angles, rng, gpu=False):
+        """
+        Perspective transform and crop_img() in one warp: crop offset and resize scale are composed
+        into the perspective matrix, so img is warped directly to output size, without the large
+        transformed image and a second resize.
+        :param M33, sl, dst_text_pnts, angles: from get_perspective_matrix()
+        :return:
+            dst: image with desired output size
+            crop_bbox: crop box on the image apply_perspective_transform() would return
+        """
+        crop_bbox, dst_size = self.get_crop_bbox(dst_text_pnts, rng)
+
+        # Part of crop box out of the transformed image is cut off, like slicing in crop_img()
+        x0 = min(max(crop_bbox[0], 0), sl)
+        y0 = min(max(crop_bbox[1], 0), sl)
+        x1 = min(max(crop_bbox[0] + crop_bbox[2], 0), sl)
+        y1 = min(max(crop_bbox[1] + crop_bbox[3], 0), sl)
+        if x1 <= x0 or y1 <= y0:
+            raise EmptyCropError('Crop box %s is out of image %s' % (crop_bbox, (sl, sl)), bbox=crop_bbox,
+                                 img_shape=(sl, sl))
+
+        crop_M = self.get_crop_matrix(x0, y0, x1, y1, dst_size)
+
+        try:
+            dst = math_utils.warpPerspective(img, np.matmul(crop_M, M33), dst_size, gpu)
+        except cv2.error as e:
+            raise WarpError('Perspective transform failed: %s' % e, angles=angles, img_shape=img.shape)
+
+        return dst, crop_bbox
+
+    def get_perspective_matrix(self, img, text_box_pnts, max_x, max_y, max_z, rng):
+        """
+        Random perspective transform like apply_perspective_transform(), without warping img
+        :return:
+            M33: perspective matrix of img
+            sl: side length of transformed image
+            dst_text_pnts: points of text after apply perspective transform
+            angles: rotate angles around X, Y, Z axis
+        """
+        transformer = self.get_perspective_transformer(max_x, max_y, max_z, rng)
+        angles = (transformer.x, transformer.y, transformer.z)
+
+        try:
+            M33, sl, _ = transformer.get_image_warp_matrix(img)
+            dst_text_pnts = transformer.transform_pnts(text_box_pnts, M33)
+        except cv2.error as e:
+            raise WarpError('Perspective transform failed: %s' % e, angles=angles, img_shape=img.shape)
+
+        if not np.isfinite(dst_text_pnts).all():
+            raise WarpError('Text box is invalid after perspective transform', angles=angles, img_shape=img.shape)
+
+        return M33, sl, dst_text_pnts, angles
+
+    def get_crop_matrix(self, x0, y0, x1, y1, dst_size):
+        """
+        Matrix of cropping (x0, y0, x1, y1) and resizing it to dst_size (width, height),
+        with same pixel center alignment as cv2.resize: dst + 0.5 = (src - x0 + 0.5) * scale
+        """
+        scale_x = dst_size[0] / (x1 - x0)
+        scale_y = dst_size[1] / (y1 - y0)
+        return np.array([
+            [scale_x, 0, (0.5 - x0) * scale_x - 0.5],
+            [0, scale_y, (0.5 - y0) * scale_y - 0.5],
+            [0, 0, 1]
+        ])
+
+    def get_perspective_transformer(self, max_x, max_y, max_z, rng):
+        """
+        :return: PerspectiveTransform with random rotate angles
+        """
+        x = math_utils.cliped_rand_norm(rng, 0, max_x)
+        y = math_utils.cliped_rand_norm(rng, 0, max_y)
+        z = math_utils.cliped_rand_norm(rng, 0, max_z)
+
+        # print("x: %f, y: %f, z: %f" % (x, y, z))
+
+        return math_utils.PerspectiveTransform(x, y, z, scale=1.0, fovy=50)
+
+    def get_output_blur(self, rng):
+        """
+        :return: random blur of output image, ('gauss', ksize, sigma) or ('norm', kernel)
+        """
+        if prob(0.5, rng):
+            return ('gauss',) + self.get_gauss_blur_params(rng, [3, 5])
         else:
-            return self.apply_norm_blur(img)
+            return 'norm', self.get_norm_blur_kernel(rng)
+
+    def apply_output_blur(self, img, blur):
+        """
+        :param blur: from get_output_blur()
+        """
+        if blur[0] == 'gauss':
+            return cv2.GaussianBlur(img, (blur[1], blur[1]), blur[2])
+        return cv2.blur(img, (blur[1], blur[1]))
+
+    def apply_gauss_blur(self, img, rng, ks=None):
+        ksize, sigma = self.get_gauss_blur_params(rng, ks)
+        img = cv2.GaussianBlur(img, (ksize, ksize), sigma)
+        return img
 
-    def apply_gauss_blur(self, img, ks=None):
+    def get_gauss_blur_params(self, rng, ks=None):
+        """
+        :return: ksize, sigma
+        """
         if ks is None:
             ks = [7, 9, 11, 13]
-        ksize = random.choice(ks)
+        ksize = ks[rng.integers(len(ks))]
 
         sigmas = [0, 1, 2, 3, 4, 5, 6, 7]
         sigma = 0
         if ksize <= 3:
-            sigma = random.choice(sigmas)
-        img = cv2.GaussianBlur(img, (ksize, ksize), sigma)
-        return img
+            sigma = sigmas[rng.integers(len(sigmas))]
+        return ksize, sigma
 
-    def apply_norm_blur(self, img, ks=None):
+    def get_norm_blur_kernel(self, rng, ks=None):
         # kernel == 1, the output image will be the same
         if ks is None:
             ks = [2, 3]
-        kernel = random.choice(ks)
-        img = cv2.blur(img, (kernel, kernel))
-        return img
+        return ks[rng.integers(len(ks))]
 
-    def apply_prydown(self, img):
+    def apply_prydown(self, img, rng):
         """
         模糊图像，模拟小图片放大的效果
         """
-        scale = random.uniform(1, self.cfg.prydown.max_scale)
+        scale = rng.uniform(1, self.cfg.prydown.max_scale)
         height = img.shape[0]
         width = img.shape[1]
 
         out = cv2.resize(img, (int(width / scale), int(height / scale)), interpolation=cv2.INTER_AREA)
         return cv2.resize(out, (width, height), interpolation=cv2.INTER_AREA)
 
-    def reverse_img(self, word_img):
-        offset = np.random.randint(-10, 10)
-        return 255 + offset - word_img
+    def reverse_imgs(self, imgs, offsets):
+        """
+        Reverse color of images with lookup tables, out = 255 + offset - img, saturated
+        :param offsets: dict, index in imgs -> offset
+        """
+        indexes = list(offsets.keys())
+        luts = np.clip(255 + np.array(list(offsets.values()))[:, np.newaxis] - np.arange(256), 0, 255)
+        luts = luts.astype(np.uint8)
+
+        if isinstance(imgs, np.ndarray):
+            batch = imgs[indexes]
+            rows = np.arange(len(indexes)).reshape((-1,) + (1,) * (batch.ndim - 1))
+            imgs[indexes] = luts[rows, batch]
+        else:
+            for i, lut in zip(indexes, luts):
+                imgs[i] = cv2.LUT(imgs[i], lut)
 
     def create_kernals(self):
         self.emboss_kernal = np.array([
@@ -628,7 +1027,7 @@ class Renderer(object):
     def apply_sharp(self, word_img):
         return cv2.filter2D(word_img, -1, self.sharp_kernel)
 
-    def apply_crop(self, text_box_pnts, crop_cfg):
+    def apply_crop(self, text_box_pnts, crop_cfg, rng):
         """
         Random crop text box height top or bottom, we don't need image information in this step, only change box pnts
         :param text_box_pnts: bbox of text [left-top, right-top, right-bottom, left-bottom]
@@ -641,13 +1040,13 @@ class Renderer(object):
 
         croped_text_box_pnts = text_box_pnts
 
-        if prob(0.5):
-            top_crop = int(random.randint(crop_cfg.top.min, crop_cfg.top.max) * scale)
+        if prob(0.5, rng):
+            top_crop = int(rng.integers(crop_cfg.top.min, crop_cfg.top.max + 1) * scale)
             self.dmsg("top crop %d" % top_crop)
             croped_text_box_pnts[0][1] += top_crop
             croped_text_box_pnts[1][1] += top_crop
         else:
-            bottom_crop = int(random.randint(crop_cfg.bottom.min, crop_cfg.bottom.max) * scale)
+            bottom_crop = int(rng.integers(crop_cfg.bottom.min, crop_cfg.bottom.max + 1) * scale)
             self.dmsg("bottom crop %d " % bottom_crop)
             croped_text_box_pnts[2][1] -= bottom_crop
             croped_text_box_pnts[3][1] -= bottom_crop
@@ -655,4 +1054,4 @@ class Renderer(object):
         return croped_text_box_pnts
 
     def is_bgr(self):
-        return self.cfg.font_color.enable or self.cfg.line_color.enable
+        return is_bgr_cfg(self.cfg)
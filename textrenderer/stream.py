@@ -0,0 +1,250 @@
+"""
+Generate text images in memory, without main.py and without writing anything to disk.
+
+    from textrenderer.stream import ImageStream
+
+    stream = ImageStream(num_workers=4, prefetch=64, seed=42,
+                         corpus_mode='random', chars_file='./data/chars/eng.txt', fonts_list='./data/fonts_list/eng.txt')
+    for img, label in stream:
+        train_step(img, label)
+"""
+import gc
+import json
+import itertools
+import traceback
+import multiprocessing as mp
+from collections import Counter
+from queue import Empty
+
+from libs.config import load_config
+import libs.font_utils as font_utils
+from textrenderer.corpus.corpus_utils import corpus_factory
+from textrenderer.renderer import Renderer, is_bgr_cfg
+from textrenderer.bg_store import BackgroundStore, DEFAULT_BG_CACHE_SIZE
+from textrenderer.errors import RenderError, RetryLimitError, get_cause
+
+# Failed attempts allowed for one image, after that RetryLimitError is raised
+DEFAULT_MAX_RETRIES = 100
+
+
+def build_renderer(config_file='./configs/default.yaml', fonts_list='./data/fonts_list/chn.txt', bg_dir='./data/bg',
+                   corpus_mode='chn', chars_file='./data/chars/chn.txt', corpus_dir='./data/corpus', length=10,
+                   img_height=32, img_width=256, clip_max_chars=False, debug=False, gpu=False, strict=False,
+                   seed=0, text_layer=False, bg_cache_size=DEFAULT_BG_CACHE_SIZE):
+    """
+    Load config, fonts, backgrounds and corpus, than create a Renderer.
+    Arguments have same meaning and default value as main.py arguments.
+    """
+    cfg = load_config(config_file)
+
+    fonts = font_utils.get_font_paths_from_list(fonts_list)
+    bgs = BackgroundStore(bg_dir, gray=not is_bgr_cfg(cfg), cache_size=bg_cache_size)
+
+    corpus = corpus_factory(corpus_mode, chars_file, corpus_dir, length)
+
+    return Renderer(corpus, fonts, bgs, cfg,
+                    height=img_height,
+                    width=img_width,
+                    clip_max_chars=clip_max_chars,
+                    debug=debug,
+                    gpu=gpu,
+                    strict=strict,
+                    seed=seed,
+                    text_layer=text_layer)
+
+
+class FailureLog(object):
+    """
+    Count failed render attempts by cause (see textrenderer.errors). If dump_path is set, every failed
+    attempt is appended to it as a json line with image index, error and inputs caused the failure.
+    Image can be rendered again with the same seed and index to reproduce a failure.
+    """
+
+    def __init__(self, dump_path=None):
+        self.counts = Counter()
+        self.dump_path = dump_path
+        self.f = None
+
+    def add(self, img_index, attempt, e):
+        cause = get_cause(e)
+        self.counts[cause] += 1
+
+        if self.dump_path is None:
+            return
+
+        record = dict(img_index=img_index, attempt=attempt, cause=cause, error=str(e))
+        if isinstance(e, RenderError):
+            record['inputs'] = e.inputs
+        else:
+            record['traceback'] = traceback.format_exception(type(e), e, e.__traceback__)
+
+        if self.f is None:
+            self.f = open(self.dump_path, mode='a', encoding='utf-8')
+        self.f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.f.flush()
+
+    def pop_counts(self):
+        """
+        :return: dict, cause -> failed attempts since last call
+        """
+        counts = dict(self.counts)
+        self.counts.clear()
+        return counts
+
+
+def gen_img(renderer, img_index, max_retries=DEFAULT_MAX_RETRIES, failures=None):
+    """
+    Render an image, retry with new random values when rendering failed.
+    :param failures: FailureLog to record failed attempts
+    """
+    imgs, words = gen_batch(renderer, [img_index], max_retries, failures)
+    return imgs[0], words[0]
+
+
+def gen_batch(renderer, indices, max_retries=DEFAULT_MAX_RETRIES, failures=None):
+    """
+    Render images like Renderer.gen_batch(), text image of every image is retried like gen_img()
+    :return: imgs, words
+    """
+    rngs = [renderer.get_rng(img_index) for img_index in indices]
+
+    word_imgs = []
+    words = []
+    for img_index, rng in zip(indices, rngs):
+        word_img, word = gen_text_img(renderer, img_index, rng, max_retries, failures)
+        word_imgs.append(word_img)
+        words.append(word)
+
+    return renderer.apply_output_effects(word_imgs, rngs), words
+
+
+def gen_text_img(renderer, img_index, rng, max_retries, failures):
+    # rng is created outside retry loop, so a retried image continues the same random stream and gets new values
+    for attempt in range(max_retries + 1):
+        try:
+            return renderer.gen_text_img(img_index, rng)
+        except Exception as e:
+            if failures is not None:
+                failures.add(img_index, attempt, e)
+            error = e
+
+    raise RetryLimitError("Image %d failed %d times, last error: %s" % (img_index, max_retries + 1, error),
+                          img_index=img_index) from error
+
+
+def get_indexes(start_index, end_index, step=1):
+    if end_index is None:
+        return itertools.count(start_index, step)
+    return range(start_index, end_index, step)
+
+
+def stream_worker(renderer, renderer_kwargs, index_range, max_retries, queue):
+    """
+    Generate images in a worker process and put (img_index, img, label) to queue,
+    put None when all indexes are finished
+    :param index_range: (start_index, end_index, step), end_index is None for infinite stream
+    """
+    try:
+        if renderer is None:
+            renderer = build_renderer(**renderer_kwargs)
+
+        for img_index in get_indexes(*index_range):
+            img, label = gen_img(renderer, img_index, max_retries)
+            queue.put((img_index, img, label))
+        queue.put(None)
+    except Exception:
+        queue.put((None, None, traceback.format_exc()))
+
+
+class ImageStream(object):
+    """
+    Iterable of (image, label) generated on the fly.
+
+    Image i is always rendered from a random generator derived from (seed, start_index + i), so a stream is
+    reproducible no matter how many workers are used. With workers, images are yielded in finish order.
+
+    :param num_workers: if 0, images are generated in the calling process. Otherwise worker processes
+                        generate images in background, and at most prefetch images are waiting to be consumed
+    :param start_index: index of first image
+    :param num_img: number of images, if None, the stream is infinite
+    :param seed: random seed of images
+    :param max_retries: failed attempts allowed for one image
+    :param renderer_kwargs: arguments of build_renderer()
+    """
+
+    def __init__(self, num_workers=0, prefetch=64, start_index=0, num_img=None, seed=0,
+                 max_retries=DEFAULT_MAX_RETRIES, **renderer_kwargs):
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.prefetch = prefetch
+        self.start_index = start_index
+        self.end_index = None if num_img is None else start_index + num_img
+        self.renderer_kwargs = dict(renderer_kwargs, seed=seed)
+        self.renderer = None
+
+    def get_renderer(self):
+        if self.renderer is None:
+            self.renderer = build_renderer(**self.renderer_kwargs)
+        return self.renderer
+
+    def __iter__(self):
+        if self.num_workers == 0:
+            return self.iter_inline()
+        return self.iter_workers()
+
+    def iter_inline(self):
+        renderer = self.get_renderer()
+        for img_index in get_indexes(self.start_index, self.end_index):
+            yield gen_img(renderer, img_index, self.max_retries)
+
+    def iter_workers(self):
+        # With fork, renderer is built once here and shared by all workers, otherwise every worker builds one
+        renderer = None
+        if mp.get_start_method() == 'fork':
+            renderer = self.get_renderer()
+
+        queue = mp.Queue(maxsize=self.prefetch)
+        workers = []
+        # Objects existing before fork are not touched by gc in workers, so their memory pages are not copied.
+        # Caller process is unfrozen after workers started
+        freeze = renderer is not None and hasattr(gc, 'freeze')
+        if freeze:
+            gc.freeze()
+        try:
+            for i in range(self.num_workers):
+                index_range = (self.start_index + i, self.end_index, self.num_workers)
+                args = (renderer, self.renderer_kwargs, index_range, self.max_retries, queue)
+                worker = mp.Process(target=stream_worker, args=args, daemon=True)
+                worker.start()
+                workers.append(worker)
+        finally:
+            if freeze:
+                gc.unfreeze()
+
+        try:
+            running = self.num_workers
+            while running > 0:
+                try:
+                    item = queue.get(timeout=1)
+                except Empty:
+                    # Worker killed before it can report an error
+                    for worker in workers:
+                        if worker.exitcode not in (None, 0):
+                            raise RuntimeError("ImageStream worker exited with code %d" % worker.exitcode)
+                    continue
+
+                if item is None:
+                    running -= 1
+                    continue
+
+                img_index, img, label = item
+                if img_index is None:
+                    raise RuntimeError("ImageStream worker failed:\n%s" % label)
+                yield img, label
+        finally:
+            # Consumer stops early or worker failed
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
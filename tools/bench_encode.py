@@ -0,0 +1,96 @@
+"""
+Compare encode time and size of output image formats on rendered images, to choose
+--img_format/--img_quality/--png_compression of main.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../', '../')))
+from libs.image_writer import ImageEncoder
+from textrenderer.stream import ImageStream
+
+# (img_format, quality, png_compression), None means opencv default
+ENCODINGS = [
+    ('jpg', None, None),
+    ('jpg', 75, None),
+    ('jpg', 90, None),
+    ('jpg', 100, None),
+    ('png', None, 0),
+    ('png', None, 1),
+    ('png', None, 3),
+    ('png', None, 6),
+    ('png', None, 9),
+    ('webp', 75, None),
+    ('webp', 90, None),
+    ('webp', 101, None),
+    ('npy', None, None),
+]
+
+
+def format_setting(img_format, quality, png_compression):
+    if img_format == 'png':
+        return 'compression %s' % ('default' if png_compression is None else png_compression)
+    if img_format == 'webp' and quality is not None and quality > 100:
+        return 'lossless'
+    if img_format in ['jpg', 'webp']:
+        return 'quality %s' % ('default' if quality is None else quality)
+    return '-'
+
+
+def bench(encoder, imgs, repeat):
+    # First pass is not timed, it warms up encoder libraries
+    sizes = [len(encoder.encode(img)) for img in imgs]
+
+    start = time.time()
+    for _ in range(repeat):
+        for img in imgs:
+            encoder.encode(img)
+    seconds = (time.time() - start) / repeat
+    return seconds / len(imgs) * 1000, sum(sizes) / len(imgs) / 1024
+
+
+def main(args):
+    stream = ImageStream(num_img=args.num_img, seed=args.seed,
+                         config_file=args.config_file,
+                         fonts_list=args.fonts_list,
+                         bg_dir=args.bg_dir,
+                         corpus_mode=args.corpus_mode,
+                         chars_file=args.chars_file,
+                         corpus_dir=args.corpus_dir,
+                         img_height=args.img_height,
+                         img_width=args.img_width)
+    imgs = [img for img, _ in stream]
+    print("Encode %d images, %dx%d" % (len(imgs), imgs[0].shape[1], imgs[0].shape[0]))
+
+    results = []
+    for img_format, quality, png_compression in ENCODINGS:
+        encoder = ImageEncoder(img_format, quality, png_compression)
+        ms, kb = bench(encoder, imgs, args.repeat)
+        results.append((img_format, format_setting(img_format, quality, png_compression), ms, kb))
+
+    npy_kb = [kb for img_format, _, _, kb in results if img_format == 'npy'][0]
+    print("{:<6} {:<16} {:>10} {:>10} {:>8}".format('format', 'setting', 'ms/img', 'KB/img', 'ratio'))
+    for img_format, setting, ms, kb in results:
+        print("{:<6} {:<16} {:>10.3f} {:>10.2f} {:>8.3f}".format(img_format, setting, ms, kb, kb / npy_kb))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_img', type=int, default=200, help='Number of rendered images to encode')
+    parser.add_argument('--repeat', type=int, default=3, help='Encode all images repeat times')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--img_height', type=int, default=32)
+    parser.add_argument('--img_width', type=int, default=256)
+    parser.add_argument('--config_file', type=str, default='./configs/default.yaml')
+    parser.add_argument('--fonts_list', type=str, default='./data/fonts_list/chn.txt')
+    parser.add_argument('--bg_dir', type=str, default='./data/bg')
+    parser.add_argument('--corpus_mode', type=str, default='chn', choices=['random', 'chn', 'eng', 'list'])
+    parser.add_argument('--chars_file', type=str, default='./data/chars/chn.txt')
+    parser.add_argument('--corpus_dir', type=str, default='./data/corpus')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
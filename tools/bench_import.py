@@ -0,0 +1,75 @@
+"""
+Measure import time of modules with `python -X importtime`, each import runs in a new interpreter.
+Exit with error when a module imports one of LAZY_MODULES, or takes more than --max_ms to import,
+so it can be used to check startup time regressions of main.py and worker processes.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(__file__, '../', '../'))
+
+# Heavy dependencies which should only be imported on code paths that need them
+LAZY_MODULES = ['matplotlib', 'fontTools', 'tenacity']
+
+
+def import_times(module):
+    """
+    :return: dict, imported module name -> cumulative import time in ms
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+    p = subprocess.run(cmd, cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+
+    out = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        out[name.strip()] = int(cumulative) / 1000
+    return out
+
+
+def main(args):
+    errors = []
+    print("{:<32} {:>10} {:>10}".format('module', 'median ms', 'min ms'))
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        times = sorted([r[module] for r in runs])
+        median = times[len(times) // 2]
+        print("{:<32} {:>10.1f} {:>10.1f}".format(module, median, times[0]))
+
+        # Top level packages imported by module, slowest first
+        top_level = sorted([(ms, name) for name, ms in runs[0].items() if '.' not in name and name != module],
+                           reverse=True)
+        for ms, name in top_level[:args.top]:
+            print("    {:<28} {:>10.1f}".format(name, ms))
+
+        lazy = [name for name in LAZY_MODULES if name in runs[0]]
+        if lazy:
+            errors.append('%s imports %s' % (module, ', '.join(lazy)))
+        if args.max_ms is not None and median > args.max_ms:
+            errors.append('%s takes %.1f ms to import, more than %.1f ms' % (module, median, args.max_ms))
+
+    if errors:
+        for error in errors:
+            print(error)
+        exit(-1)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=['main', 'textrenderer.stream'],
+                        help='Modules to import, relative to repo root')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imported packages to print')
+    parser.add_argument('--max_ms', type=float, default=None,
+                        help='Exit with error if median import time of a module is longer than this')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
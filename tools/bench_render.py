@@ -0,0 +1,93 @@
+"""
+Compare per image render time of canvas mode (text drawn on a large background, whole background is
+perspective transformed) and text layer mode (--text_layer, only a tight text mask is transformed).
+Draw/transform time is the part before output effects (noise, blur...), which are same in both modes.
+With --stages, mean time and memory of every render stage are printed too.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../', '../')))
+from textrenderer.stream import build_renderer
+from textrenderer.pipeline import StageProfiler
+
+MODES = ['canvas', 'text_layer']
+
+
+def bench(args, mode):
+    text_layer = mode == 'text_layer'
+    renderer = build_renderer(config_file=args.config_file,
+                              fonts_list=args.fonts_list,
+                              bg_dir=args.bg_dir,
+                              corpus_mode=args.corpus_mode,
+                              chars_file=args.chars_file,
+                              corpus_dir=args.corpus_dir,
+                              img_height=args.img_height,
+                              img_width=args.img_width,
+                              seed=args.seed,
+                              text_layer=text_layer)
+
+    # Text stages and output stages are profiled separately, so stages with same name are not mixed
+    text_profiler = StageProfiler(args.trace_malloc)
+    text_profiler.attach(renderer.text_pipeline)
+    output_profiler = StageProfiler(args.trace_malloc)
+    output_profiler.attach(renderer.output_pipeline)
+
+    failed = 0
+    start = time.time()
+    for i in range(args.num_img):
+        try:
+            renderer.gen_img(i)
+        except Exception:
+            failed += 1
+    seconds = time.time() - start
+
+    # draw/transform time of successful images, failed attempts don't reach the last text stage
+    stats = list(text_profiler.stats.values())
+    stage_ms = sum([s[1] for s in stats]) / stats[-1][0] * 1000
+
+    profilers = OrderedDict([('text stages', text_profiler), ('output stages', output_profiler)])
+    return stage_ms, seconds / args.num_img * 1000, failed, profilers
+
+
+def main(args):
+    results = [(mode,) + bench(args, mode) for mode in args.modes]
+
+    if args.stages:
+        for mode, _, _, _, profilers in results:
+            for name, profiler in profilers.items():
+                print("[%s] %s" % (mode, name))
+                profiler.report()
+            print()
+
+    print("Render %d images, %dx%d" % (args.num_img, args.img_width, args.img_height))
+    print("{:<12} {:>18} {:>10} {:>8}".format('mode', 'draw/transform ms', 'total ms', 'failed'))
+    for mode, stage_ms, total_ms, failed, _ in results:
+        print("{:<12} {:>18.2f} {:>10.2f} {:>8d}".format(mode, stage_ms, total_ms, failed))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', type=str, nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--num_img', type=int, default=200, help='Number of images rendered in each mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', action='store_true', default=False,
+                        help='Print mean time and memory of every render stage')
+    parser.add_argument('--trace_malloc', action='store_true', default=False,
+                        help='Also trace peak memory allocated in every stage, rendering becomes slower')
+    parser.add_argument('--img_height', type=int, default=32)
+    parser.add_argument('--img_width', type=int, default=256)
+    parser.add_argument('--config_file', type=str, default='./configs/default.yaml')
+    parser.add_argument('--fonts_list', type=str, default='./data/fonts_list/chn.txt')
+    parser.add_argument('--bg_dir', type=str, default='./data/bg')
+    parser.add_argument('--corpus_mode', type=str, default='chn', choices=['random', 'chn', 'eng', 'list'])
+    parser.add_argument('--chars_file', type=str, default='./data/chars/chn.txt')
+    parser.add_argument('--corpus_dir', type=str, default='./data/corpus')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
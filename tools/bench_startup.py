@@ -0,0 +1,53 @@
+"""
+Measure time to first image of main.py: wall time of generating a single image, in inline mode
+(--num_processes 1) and with worker pools of different sizes.
+Arguments not listed here are passed to main.py, e.g. --corpus_mode random --chars_file ./data/chars/eng.txt
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(__file__, '../', '../'))
+
+
+def run_main(num_processes, output_dir, main_args):
+    cmd = [sys.executable, os.path.join(ROOT_DIR, 'main.py'),
+           '--num_img', '1',
+           '--num_processes', str(num_processes),
+           '--output_dir', output_dir,
+           '--tag', 'p%d' % num_processes] + main_args
+
+    start = time.time()
+    subprocess.run(cmd, cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL)
+    seconds = time.time() - start
+
+    shutil.rmtree(os.path.join(output_dir, 'p%d' % num_processes))
+    return seconds
+
+
+def main(args, main_args):
+    output_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        print("{:<12} {:>10} {:>10}".format('processes', 'median s', 'min s'))
+        for num_processes in args.processes:
+            times = sorted([run_main(num_processes, output_dir, main_args) for _ in range(args.repeat)])
+            mode = 'inline' if num_processes == 1 else 'pool %d' % num_processes
+            print("{:<12} {:>10.3f} {:>10.3f}".format(mode, times[len(times) // 2], times[0]))
+    finally:
+        shutil.rmtree(output_dir)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted(set([1, 2, os.cpu_count()])),
+                        help='Number of processes to compare, 1 is inline mode')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_known_args()
+
+
+if __name__ == '__main__':
+    main(*parse_arguments())
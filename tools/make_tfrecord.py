@@ -1,4 +1,5 @@
 import os
+import sys
 import argparse
 
 import cv2
@@ -6,9 +7,18 @@ import numpy as np
 import tensorflow as tf
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../', '../')))
+from libs.utils import get_img_rel_path
+from libs.manifest import Manifest
+
 
 def read_image(path, size=None):
-    img = cv2.imread(path, 0)
+    if path.endswith('.npy'):
+        img = np.load(path)
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    else:
+        img = cv2.imread(path, 0)
     if size is not None:
         img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
     img = img.astype(np.float32)
@@ -33,16 +43,17 @@ def load_labels(filepath):
     return labels
 
 
-def build_img_paths(img_dir, img_count):
+def build_img_paths(img_dir, img_count, start_index=0, files_per_dir=0, ext='.jpg'):
     """
     Image name should be eight length with continue num. e.g. 00000000.jpg, 00000001.jpg
+    If files_per_dir > 0, images are in sub dirs. e.g. 00000/00000000.jpg
     """
     img_paths = []
     names = []
-    for i in range(img_count):
-        base_name = "{:08d}.jpg".format(i)
-        names.append(base_name)
-        img_path = os.path.join(img_dir, base_name)
+    for i in range(start_index, start_index + img_count):
+        rel_path = get_img_rel_path(i, files_per_dir, ext)
+        names.append(os.path.basename(rel_path))
+        img_path = os.path.join(img_dir, rel_path)
         img_paths.append(img_path)
 
     return img_paths, names
@@ -50,7 +61,12 @@ def build_img_paths(img_dir, img_count):
 
 def main(args):
     labels = load_labels(args.label_file)
-    paths, names = build_img_paths(args.img_dir, len(labels))
+
+    # Index of first image and dir layout are saved in progress manifest by main.py
+    manifest = Manifest.load(args.img_dir)
+    files_per_dir = args.files_per_dir if args.files_per_dir is not None else manifest.files_per_dir
+    paths, names = build_img_paths(args.img_dir, len(labels), manifest.start_index, files_per_dir,
+                                   '.' + manifest.img_format)
 
     data_name = 'image'
     label_name = 'label'
@@ -91,6 +107,8 @@ def parse_arguments():
     parser.add_argument('--name', type=str, default='test', help='Output tf records file name')
     parser.add_argument('--raw', action='store_true', default=False)
     parser.add_argument('-f', '--force', action='store_true', default=False)
+    parser.add_argument('--files_per_dir', type=int, default=None,
+                        help='Images sub dir layout, same as main.py. If None, read from progress.json in img_dir')
     args = parser.parse_args()
 
     if not os.path.exists(args.img_dir):
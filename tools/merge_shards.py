@@ -0,0 +1,237 @@
+"""
+Stitch output dirs generated by main.py --num_shards into one dataset.
+Images (or tar shards) are moved (or hard linked) into dst dir without copying image bytes,
+labels are concatenated in index order.
+
+Before anything is moved or deleted, every shard is checked to contain exactly the images its manifest
+describes, and no file may overwrite another shard's file or an existing file in dst dir.
+"""
+import argparse
+import glob
+import os
+import shutil
+import struct
+import sys
+import tarfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../', '../')))
+from libs.manifest import Manifest, MANIFEST_NAME, count_lines
+from libs.label_utils import SHARD_DIR_NAME
+
+LABEL_NAME = 'labels.txt'
+SIDECAR_NAMES = [LABEL_NAME, MANIFEST_NAME, SHARD_DIR_NAME]
+# Shards merged into one dir should have same image layout
+LAYOUT_NAMES = ['files_per_dir', 'output_mode', 'img_format']
+
+
+def load_shard_manifests(shard_dirs):
+    """
+    :return: manifests sorted by start_index, index ranges of shards must be continuous
+    """
+    manifests = []
+    for shard_dir in shard_dirs:
+        manifest = Manifest.load(shard_dir)
+        if not manifest.exists():
+            print("%s not found" % manifest.path)
+            exit(-1)
+
+        if not manifest.is_finished() or manifest.shards:
+            print("Shard %s is not finished, run main.py with same arguments to resume it" % shard_dir)
+            exit(-1)
+
+        manifests.append(manifest)
+
+    for name in LAYOUT_NAMES:
+        if len(set([getattr(m, name) for m in manifests])) != 1:
+            print("Shards have different %s, they can not be merged into one dir" % name)
+            exit(-1)
+
+    # Images of a merged dataset should be reproducible from one seed
+    if len(set([m.seed for m in manifests])) != 1:
+        print("Shards have different seeds, run main.py with same --seed on every shard")
+        exit(-1)
+
+    if manifests[0].output_mode == 'memmap':
+        print("Shards of memmap output mode can not be merged, every shard has its own images.npy")
+        exit(-1)
+
+    manifests = sorted(manifests, key=lambda m: m.start_index)
+    for prev, cur in zip(manifests[:-1], manifests[1:]):
+        if cur.start_index != prev.end_index:
+            print("Index range of shards are not continuous: [%d, %d) [%d, %d)" % (
+                prev.start_index, prev.end_index, cur.start_index, cur.end_index))
+            exit(-1)
+
+    return manifests
+
+
+def list_images(src_dir, dst_dir):
+    """
+    All image files (keep sub dirs) in src_dir, label and progress files are skipped
+    :return: list of (src_path, dst_path)
+    """
+    moves = []
+    for entry in os.scandir(src_dir):
+        if entry.name in SIDECAR_NAMES:
+            continue
+
+        dst_path = os.path.join(dst_dir, entry.name)
+        if entry.is_dir():
+            moves.extend(list_images(entry.path, dst_path))
+        else:
+            moves.append((entry.path, dst_path))
+    return moves
+
+
+def count_tar_images(path):
+    with tarfile.open(path, mode='r:') as tar:
+        return len([member for member in tar if not member.name.endswith('.txt')])
+
+
+def count_tfrecord_images(path):
+    count = 0
+    with open(path, mode='rb') as f:
+        while True:
+            header = f.read(12)
+            if not header:
+                break
+            length = struct.unpack('<Q', header[:8])[0]
+            # data and its crc
+            f.seek(length + 4, os.SEEK_CUR)
+            count += 1
+    return count
+
+
+def count_images(paths, manifest):
+    """
+    :param paths: files of a shard dir
+    :return: number of images in files, images inside tar/tfrecord files are counted one by one
+    """
+    if manifest.output_mode == 'tar':
+        return sum([count_tar_images(p) for p in paths if p.endswith('.tar')])
+    if manifest.output_mode == 'tfrecord':
+        return sum([count_tfrecord_images(p) for p in paths if p.endswith('.tfrecords')])
+    return len([p for p in paths if p.endswith('.' + manifest.img_format)])
+
+
+def plan_moves(shard_dirs, manifests, dst_dir):
+    """
+    Check shards can be merged into dst_dir without losing any image
+    :return: list of (src_path, dst_path) of all shards
+    """
+    moves = []
+    for shard_dir, manifest in zip(shard_dirs, manifests):
+        shard_moves = list_images(shard_dir, dst_dir)
+        count = count_images([src for src, _ in shard_moves], manifest)
+        expected = manifest.end_index - manifest.start_index
+        if count != expected:
+            print("Shard %s has %d images, but its manifest has %d images [%d, %d)" % (
+                shard_dir, count, expected, manifest.start_index, manifest.end_index))
+            exit(-1)
+
+        label_path = os.path.join(shard_dir, LABEL_NAME)
+        if manifest.output_mode == 'files' and count_lines(label_path) != expected:
+            print("%s has %d labels, but its manifest has %d images" % (label_path, count_lines(label_path),
+                                                                       expected))
+            exit(-1)
+        moves.extend(shard_moves)
+
+    dst_paths = set()
+    for src_path, dst_path in moves:
+        if dst_path in dst_paths:
+            print("%s conflicts with a file of another shard, it would be overwritten" % src_path)
+            exit(-1)
+        if os.path.lexists(dst_path):
+            print("%s already exists, it would be overwritten by %s" % (dst_path, src_path))
+            exit(-1)
+        dst_paths.add(dst_path)
+
+    return moves
+
+
+def move_images(moves, link=False):
+    """
+    Move (or hard link) files planned by plan_moves()
+    """
+    for src_path, dst_path in moves:
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if link:
+            os.link(src_path, dst_path)
+        else:
+            os.replace(src_path, dst_path)
+
+
+def merge_labels(shard_dirs, label_path):
+    with open(label_path, mode='wb') as out:
+        for shard_dir in shard_dirs:
+            with open(os.path.join(shard_dir, LABEL_NAME), mode='rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+
+
+def main(args):
+    manifests = load_shard_manifests(args.shard_dirs)
+    shard_dirs = [os.path.dirname(m.path) for m in manifests]
+
+    dst = Manifest.load(args.dst_dir)
+    if dst.exists():
+        print("%s already exists" % dst.path)
+        exit(-1)
+
+    moves = plan_moves(shard_dirs, manifests, args.dst_dir)
+    move_images(moves, args.link)
+    for shard_dir, manifest in zip(shard_dirs, manifests):
+        print("Merge images [%d, %d) from %s" % (manifest.start_index, manifest.end_index, shard_dir))
+
+    # Labels of tar shards are inside tar files
+    if manifests[0].output_mode == 'files':
+        merge_labels(shard_dirs, os.path.join(args.dst_dir, LABEL_NAME))
+
+    dst.start_index = manifests[0].start_index
+    dst.end_index = manifests[-1].end_index
+    dst.next_index = dst.end_index
+    dst.run = max([m.run for m in manifests])
+    dst.seed = manifests[0].seed
+    for name in LAYOUT_NAMES:
+        setattr(dst, name, getattr(manifests[0], name))
+    dst.save()
+
+    if not args.link:
+        # Only sidecar files are left in shard dirs when all images are moved
+        missing = [dst_path for _, dst_path in moves if not os.path.exists(dst_path)]
+        left = [src for shard_dir in shard_dirs for src, _ in list_images(shard_dir, args.dst_dir)]
+        if missing or left:
+            print("%d files are not merged, shard dirs are kept" % (len(missing) + len(left)))
+            exit(-1)
+
+        for shard_dir in shard_dirs:
+            shutil.rmtree(shard_dir)
+
+    print("Merge %d shards to %s, images [%d, %d)" % (len(shard_dirs), args.dst_dir,
+                                                      dst.start_index, dst.end_index))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards_dir', type=str, default='./output/default',
+                        help='Dir contains shard_xxxxx dirs, e.g. output_dir/{tag}')
+    parser.add_argument('--dst_dir', type=str, default=None,
+                        help='Merged dataset dir. If None, merge into shards_dir')
+    parser.add_argument('--link', action='store_true', default=False,
+                        help='Hard link images instead of moving them, shard dirs are kept')
+    args = parser.parse_args()
+
+    args.shard_dirs = sorted(glob.glob(os.path.join(args.shards_dir, 'shard_*')))
+    if len(args.shard_dirs) == 0:
+        parser.error("No shard dir found in %s" % args.shards_dir)
+
+    if args.dst_dir is None:
+        args.dst_dir = args.shards_dir
+
+    if not os.path.exists(args.dst_dir):
+        os.makedirs(args.dst_dir)
+
+    return args
+
+
+if __name__ == '__main__':
+    main(parse_arguments())